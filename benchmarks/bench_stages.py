@@ -0,0 +1,145 @@
+"""
+Times each pipeline stage separately on generated corpora, plus end to end, and writes the results as JSON.
+
+    python benchmarks/bench_stages.py --out before.json
+    python benchmarks/bench_stages.py --out after.json --compare before.json
+
+stages: tokenize_input_string, validate_and_convert_input_string, to_tree, collapse,
+        calculate_uncached (strip, parse, optimize, compile and evaluate), calculate_cached (parse cache hits)
+Each stage is timed best of --repeat, and its peak allocation is measured separately with tracemalloc.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+from calculator import build_basic_calc
+from corpus import generate_corpus
+
+# (name, parameters), the scaling corpora vary one parameter at a time
+CORPORA = [
+    *((f"terms={terms}", {"terms": terms}) for terms in (10, 100, 1000, 10000)),
+    *((f"depth={depth}", {"terms": 100, "depth": depth}) for depth in (1, 10, 50)),
+    *((f"mix={mix}", {"terms": 100, "mix": mix}) for mix in ("additive", "all")),
+    *((f"unary={unary}", {"terms": 100, "unary": unary}) for unary in (10, 100)),
+]
+QUICK_CORPORA = [("terms=10", {"terms": 10}), ("terms=100", {"terms": 100}), ("depth=10", {"terms": 100, "depth": 10})]
+
+
+def _stages(calc, expressions : list[str]) -> list[tuple]:
+    # each stage gets the previous stage's output computed ahead of time, so only the stage itself is timed
+    stripped = [calc.strip_input(expr) for expr in expressions]
+    tokens = [calc.tokenize_input_string(expr) for expr in stripped]
+    processed = [calc.validate_and_convert_input_string(t, expr) for t, expr in zip(tokens, stripped)]
+    trees = [calc.to_tree(p) for p in processed]
+    for expr in expressions:
+        calc.calculate(expr)
+
+    return [
+        ("tokenize_input_string", lambda: [calc.tokenize_input_string(expr) for expr in stripped]),
+        ("validate_and_convert_input_string", lambda: [calc.validate_and_convert_input_string(t, expr) for t, expr in zip(tokens, stripped)]),
+        ("to_tree", lambda: [calc.to_tree(p) for p in processed]),
+        ("collapse", lambda: [calc.collapse(tree) for tree in trees]),
+        ("calculate_uncached", lambda: [calc.compile_cleaned(calc.strip_input(expr)).evaluate() for expr in expressions]),
+        ("calculate_cached", lambda: [calc.calculate(expr) for expr in expressions]),
+    ]
+
+
+def _best_time(func, repeat : int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _peak_bytes(func) -> int:
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(corpora : list[tuple], chars : int, repeat : int, seed : int) -> list[dict]:
+    calc = build_basic_calc()
+    # the parse cache has to hold a whole corpus for the cached stage
+    calc.parseCache.maxsize = 1 << 20
+    results = []
+    for name, parameters in corpora:
+        # about the same number of characters per corpus, so the stages take comparable time
+        count = max(1, chars // (parameters["terms"] * 4))
+        expressions = generate_corpus(count, seed=seed, **parameters)
+        totalChars = sum(map(len, expressions))
+
+        for stage, func in _stages(calc, expressions):
+            seconds = _best_time(func, repeat)
+            results.append({
+                "corpus": name,
+                "parameters": parameters,
+                "expressions": count,
+                "chars": totalChars,
+                "stage": stage,
+                "seconds": seconds,
+                "ops_per_second": count / seconds,
+                "chars_per_second": totalChars / seconds,
+                "peak_bytes": _peak_bytes(func),
+            })
+            print(f"{name:<16} {stage:<34} {count / seconds:>12,.0f} expr/s {totalChars / seconds:>14,.0f} chars/s {results[-1]['peak_bytes']:>12,} B peak")
+    return results
+
+
+def compare(baseline : dict, current : dict):
+    """ Ratio of current to baseline throughput per corpus and stage, above 1 is faster"""
+    before = {(r["corpus"], r["stage"]): r for r in baseline["results"]}
+    for result in current["results"]:
+        old = before.get((result["corpus"], result["stage"]))
+        if old is None:
+            continue
+        speedup = result["ops_per_second"] / old["ops_per_second"]
+        memory = result["peak_bytes"] / old["peak_bytes"] if old["peak_bytes"] else float("nan")
+        print(f"{result['corpus']:<16} {result['stage']:<34} {speedup:>7.2f}x speed {memory:>7.2f}x peak memory")
+
+
+def main(argv : list[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=None, help="write the results as JSON")
+    parser.add_argument("--compare", default=None, help="a previous JSON result to compare against")
+    parser.add_argument("--chars", type=int, default=200_000, help="approximate characters per corpus")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="a few small corpora")
+    args = parser.parse_args(argv)
+
+    with warnings.catch_warnings(), np.errstate(all="ignore"):
+        # the generated corpora divide by zero and overflow now and then
+        warnings.simplefilter("ignore")
+        results = run(QUICK_CORPORA if args.quick else CORPORA, args.chars, args.repeat, args.seed)
+
+    report = {
+        "meta": {
+            "python": sys.version,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "config": {"chars": args.chars, "repeat": args.repeat, "seed": args.seed, "quick": args.quick},
+        "results": results,
+    }
+    if args.out is not None:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Deterministic expression corpora for benchmarking, the same seed and parameters always give the same expressions.
+
+terms    number of operands in an expression (its length)
+depth    how deeply separators nest, exactly this deep
+mix      binary operator weights, see MIXES
+unary    number of unary functions wrapped around operands
+"""
+import random
+
+# binary operator -> relative weight
+MIXES = {
+    "additive": {"+": 1, "-": 1},
+    "arithmetic": {"+": 3, "-": 3, "*": 2, "/": 2},
+    "all": {"+": 3, "-": 3, "*": 2, "/": 2, "%": 1, "^": 1},
+}
+UNARY = ["sin", "cos", "atan", "sqrt", "abs"]
+
+
+def _operand(rng : random.Random) -> str:
+    if rng.random() < 0.2:
+        return f"{rng.randint(1, 999)}.{rng.randint(0, 99)}"
+    return str(rng.randint(1, 99))
+
+
+def generate_expression(rng : random.Random, terms : int, depth : int = 0, mix : str = "arithmetic", unary : int = 0) -> str:
+    operators, weights = zip(*MIXES[mix].items())
+    operands = [_operand(rng) for _ in range(terms)]
+
+    # unary functions around random operands, possibly stacked
+    for _ in range(unary):
+        i = rng.randrange(terms)
+        operands[i] = f"{rng.choice(UNARY)}({operands[i]})"
+
+    # nested spans of operands, each inside the previous one
+    opens = [0] * terms
+    closes = [0] * terms
+    start, stop = 0, terms - 1
+    for _ in range(depth):
+        start = rng.randint(start, stop)
+        stop = rng.randint(start, stop)
+        opens[start] += 1
+        closes[stop] += 1
+
+    parts = []
+    for i, operand in enumerate(operands):
+        if i > 0:
+            parts.append(rng.choices(operators, weights)[0])
+        parts.append("(" * opens[i] + operand + ")" * closes[i])
+    return "".join(parts)
+
+
+def generate_corpus(count : int, terms : int, depth : int = 0, mix : str = "arithmetic", unary : int = 0, seed : int = 0) -> list[str]:
+    rng = random.Random(f"{seed}-{count}-{terms}-{depth}-{mix}-{unary}")
+    return [generate_expression(rng, terms, depth, mix, unary) for _ in range(count)]
@@ -0,0 +1,83 @@
+"""
+Load generator for calculator.server, reports throughput and p50/p99 latency.
+
+    python benchmarks/load_server.py --connections 8 --requests 20000
+    python benchmarks/load_server.py --port 8765 --requests 20000   (against a running server)
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from calculator import build_basic_calc
+from calculator.server import CalculatorServer, CalculatorClient
+
+
+def _expressions(count : int, seed : int = 0) -> list[tuple[str, dict]]:
+    # a mix of repeated (parse cache hits) and distinct expressions, some with variables
+    rng = random.Random(seed)
+    templates = ["{a}+{b}*{c}", "sin({a})^2+cos({b})^2", "sqrt({a})*({b}-{c})/({a}+1)", "a*{b}+b", "{a}!+{b}%{c}"]
+    expressions = []
+    for _ in range(count):
+        template = rng.choice(templates)
+        numbers = {name: rng.randint(1, 9 if rng.random() < 0.5 else 99) for name in "abc"}
+        variables = {"a": rng.random(), "b": rng.random()} if template.startswith("a*") else {}
+        expressions.append((template.format(**numbers), variables))
+    return expressions
+
+
+def _percentile(values : list[float], q : float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def _run_connection(connect, expressions : list[tuple[str, dict]], concurrency : int, latencies : list[float]):
+    async with await connect() as client:
+        queue = iter(expressions)
+
+        async def worker():
+            for expression, variables in queue:
+                start = time.perf_counter()
+                await client.calculate(expression, **variables)
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def _main(args):
+    server = None
+    if args.port is None and args.unix is None:
+        server = await CalculatorServer(build_basic_calc(), workers=args.workers, executor=args.executor).start_tcp()
+        host, port = server.address[:2]
+        connect = lambda: CalculatorClient.connect_tcp(host, port)
+    elif args.unix is not None:
+        connect = lambda: CalculatorClient.connect_unix(args.unix)
+    else:
+        connect = lambda: CalculatorClient.connect_tcp(args.host, args.port)
+
+    expressions = _expressions(args.requests)
+    perConnection = [expressions[i::args.connections] for i in range(args.connections)]
+    latencies = []
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_run_connection(connect, part, args.concurrency, latencies) for part in perConnection))
+    seconds = time.perf_counter() - start
+
+    if server is not None:
+        await server.close()
+
+    print(f"requests: {len(latencies)}  seconds: {seconds:.3f}  requests/s: {len(latencies) / seconds:,.0f}")
+    print(f"p50: {_percentile(latencies, 0.50) * 1e3:.3f} ms  p99: {_percentile(latencies, 0.99) * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="server to load, an in-process server is started if not given")
+    parser.add_argument("--unix", default=None)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight per connection")
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    asyncio.run(_main(parser.parse_args()))
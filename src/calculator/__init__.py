@@ -1,2 +1,7 @@
 from .calculator import Calculator, CalculatorBuilder
+from ._compiled import CompiledExpression
+from ._flattree import FlatTree
+from ._graph import FormulaGraph
+from ._limits import Limits, ResourceLimitError
+from ._scalar import SCALAR_RTOL
 from .repl import build_basic_calc, repl
\ No newline at end of file
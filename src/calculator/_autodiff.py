@@ -0,0 +1,198 @@
+"""
+Forward mode automatic differentiation over compiled programs.
+
+Every value on the stack carries a tangent: one entry per differentiated variable, None where the partial is known
+to be zero. Operators need a derivative rule, unary f(x): rule(x) -> f'(x), binary f(a, b): a pair of rules
+(a, b) -> df/da and (a, b) -> df/db. Rules only run where a tangent is non zero, so operators without one
+(eg factorial) are fine on constants. Numpy ufuncs have known rules, see DERIVATIVES.
+"""
+import inspect
+
+import numpy as np
+
+from ._bytecode import Program, LOAD_CONST, LOAD_VAR, CALL_UNARY, CALL_BINARY, STORE_TEMP
+
+
+def _one(*args):
+    return 1.0
+
+
+def _minus_one(*args):
+    return -1.0
+
+
+def _first(a, b):
+    return a
+
+
+def _second(a, b):
+    return b
+
+
+def _divide_b(a, b):
+    return -a / (b * b)
+
+
+def _reciprocal_b(a, b):
+    return 1 / b
+
+
+def _remainder_b(a, b):
+    return -np.floor(a / b)
+
+
+def _power_a(a, b):
+    return b * np.power(a, b - 1)
+
+
+def _power_b(a, b):
+    return np.power(a, b) * np.log(a)
+
+
+def _reciprocal(x):
+    return 1 / x
+
+
+def _log10(x):
+    return 1 / (x * np.log(10))
+
+
+def _log2(x):
+    return 1 / (x * np.log(2))
+
+
+def _sqrt(x):
+    return 0.5 / np.sqrt(x)
+
+
+def _cos(x):
+    return -np.sin(x)
+
+
+def _tan(x):
+    return 1 / np.cos(x) ** 2
+
+
+def _arcsin(x):
+    return 1 / np.sqrt(1 - x * x)
+
+
+def _arccos(x):
+    return -1 / np.sqrt(1 - x * x)
+
+
+def _arctan(x):
+    return 1 / (1 + x * x)
+
+
+DERIVATIVES = {
+    np.add: (_one, _one),
+    np.subtract: (_one, _minus_one),
+    np.multiply: (_second, _first),
+    np.divide: (_reciprocal_b, _divide_b),
+    np.remainder: (_one, _remainder_b),
+    np.power: (_power_a, _power_b),
+    np.negative: _minus_one,
+    np.absolute: np.sign,
+    np.exp: np.exp,
+    np.log: _reciprocal,
+    np.log10: _log10,
+    np.log2: _log2,
+    np.sqrt: _sqrt,
+    np.sin: np.cos,
+    np.cos: _cos,
+    np.tan: _tan,
+    np.arcsin: _arcsin,
+    np.arccos: _arccos,
+    np.arctan: _arctan,
+}
+
+
+def derivative_rule(func, derivative = None):
+    """ The user supplied rule, else the known rule of a numpy ufunc, else None"""
+    if derivative is not None:
+        return derivative
+    try:
+        # memoized or guarded ufuncs (see _memo, _limits) keep their rule
+        return DERIVATIVES.get(inspect.unwrap(func))
+    except TypeError:
+        # unhashable callable
+        return None
+
+
+def _chain(tangents : list, rule, *args) -> list:
+    # tangents of the argument times its partial derivative
+    if tangents is None:
+        return None
+    derivative = rule(*args)
+    return [None if t is None else derivative * t for t in tangents]
+
+
+def _add(left : list, right : list) -> list:
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return [r if l is None else l if r is None else l + r for l, r in zip(left, right)]
+
+
+def forward(program : Program, derivatives : list, variables : dict, wrt : tuple[str, ...]) -> tuple:
+    """ Value of the program and its partial derivatives with respect to wrt, in one pass
+    derivatives has the rule for every entry in program.functions
+    """
+    bound = program.bind(variables) if program.variables else None
+    wrtIndex = {name: i for i, name in enumerate(wrt)}
+    code = program.code
+
+    values = []
+    tangents = []
+    temps = [None] * program.tempSize
+
+    for i, (op, arg) in enumerate(program.instructions):
+        if op == LOAD_CONST:
+            values.append(arg)
+            tangents.append(None)
+        elif op == LOAD_VAR:
+            values.append(bound[arg])
+            name = program.variables[arg]
+            if name in wrtIndex:
+                unit = [None] * len(wrt)
+                unit[wrtIndex[name]] = 1.0
+                tangents.append(unit)
+            else:
+                tangents.append(None)
+        elif op == CALL_UNARY:
+            x = values[-1]
+            values[-1] = arg(x)
+            if tangents[-1] is not None:
+                rule = derivatives[code[2*i+1]]
+                if rule is None:
+                    raise ValueError(f"No derivative rule for operator: {{{program.functionNames[code[2*i+1]][1]}}} !")
+                tangents[-1] = _chain(tangents[-1], rule, x)
+        elif op == CALL_BINARY:
+            b = values.pop()
+            a = values[-1]
+            tb = tangents.pop()
+            ta = tangents[-1]
+            values[-1] = arg(a, b)
+            if ta is not None or tb is not None:
+                rule = derivatives[code[2*i+1]]
+                if rule is None:
+                    raise ValueError(f"No derivative rule for operator: {{{program.functionNames[code[2*i+1]][1]}}} !")
+                tangents[-1] = _add(_chain(ta, rule[0], a, b), _chain(tb, rule[1], a, b))
+        elif op == STORE_TEMP:
+            temps[arg] = (values[-1], tangents[-1])
+        else:
+            value, tangent = temps[arg]
+            values.append(value)
+            tangents.append(tangent)
+
+    value = values[-1]
+    tangent = tangents[-1] or [None] * len(wrt)
+    shape = np.shape(value)
+    partials = {}
+    for name, t in zip(wrt, tangent):
+        partial = 0.0 if t is None else t
+        # d a/d a is carried as 1.0, spread it to the value's shape
+        partials[name] = np.broadcast_to(partial, shape).copy() if shape and np.shape(partial) != shape else partial
+    return value, partials
@@ -0,0 +1,72 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from typing import Iterable, Iterator
+
+# set in each worker process by _init_worker, so the calculator is sent once per worker instead of once per chunk
+_worker_calculator = None
+
+
+def _init_worker(calculator):
+    global _worker_calculator
+    _worker_calculator = calculator
+
+
+def calculate_chunk(calculator, raw_inputs : list[str]) -> list:
+    # errors are returned in place of the result so one bad expression doesn't stop the batch
+    results = []
+    for raw_input in raw_inputs:
+        try:
+            results.append(calculator.calculate(raw_input))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _calculate_chunk_in_worker(raw_inputs : list[str]) -> list:
+    return calculate_chunk(_worker_calculator, raw_inputs)
+
+
+def _chunks(raw_inputs : Iterable[str], chunksize : int) -> Iterator[list[str]]:
+    iterator = iter(raw_inputs)
+    while True:
+        chunk = list(islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_calculate_many(calculator, raw_inputs : Iterable[str], workers : int = None, executor : str = "process", chunksize : int = 256) -> Iterator:
+    """ Lazily calculate an iterable of expressions, results come out in input order
+    at most 2 chunks per worker are in flight, so memory stays bounded for any input length
+    """
+    if chunksize < 1:
+        raise ValueError("Chunk size must be at least 1!")
+    if executor not in ("process", "thread"):
+        raise ValueError('Executor must be "process" or "thread"!')
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers <= 1:
+        for chunk in _chunks(raw_inputs, chunksize):
+            yield from calculate_chunk(calculator, chunk)
+        return
+
+    if executor == "process":
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(calculator,))
+        func = _calculate_chunk_in_worker
+    else:
+        pool = ThreadPoolExecutor(workers)
+        func = partial(calculate_chunk, calculator)
+
+    with pool:
+        pending = deque()
+        for chunk in _chunks(raw_inputs, chunksize):
+            pending.append(pool.submit(func, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
@@ -0,0 +1,281 @@
+from array import array
+from collections import Counter
+from functools import cached_property
+from typing import Callable
+
+import numpy as np
+
+from ._utils import _throwEquationSyntaxErrorWIndex
+from ._limits import until
+from ._nodes import Node, ConstantNode, VariableNode, UnaryOpNode, BinaryOpNode, BINARY
+
+# opcodes, every instruction is an (opcode, argument) pair
+LOAD_CONST = 0   # argument: index into the constant pool
+LOAD_VAR = 1     # argument: index into the variable names
+CALL_UNARY = 2   # argument: index into the function table
+CALL_BINARY = 3  # argument: index into the function table
+STORE_TEMP = 4   # argument: temporary slot, the value stays on the stack
+LOAD_TEMP = 5    # argument: temporary slot
+
+OPNAMES = ["LOAD_CONST", "LOAD_VAR", "CALL_UNARY", "CALL_BINARY", "STORE_TEMP", "LOAD_TEMP"]
+
+
+class Program:
+    """ Flat postfix program for a stack machine, lowered from a parsed tree
+    tables are tuples and run keeps its stack local, so one program can be run from many threads at once
+    """
+    def __init__(
+        self,
+        code : array,
+        constants : list,
+        functions : list,
+        functionNames : list[tuple[str, str]],
+        variables : list[str],
+        stackSize : int,
+        source : str = "",
+        variablePositions : list[int] = None,
+        tempSize : int = 0,
+        scalarVariant : Callable = None,
+    ):
+        # flat opcode, argument, opcode, argument, ... an array, or a memoryview of a memory mapped file (see _serialize)
+        self.code = code
+        self.constants = tuple(constants)
+        self.functions = tuple(functions)
+        # scalarVariant(kind, symbol, func) gives the function used in the scalar execution mode
+        self.scalarVariant = scalarVariant
+        # (operator kind, symbol) for every entry in functions
+        self.functionNames = tuple(functionNames)
+        self.variables = tuple(variables)
+        self.stackSize = stackSize
+        # slots for subexpressions that are used more than once
+        self.tempSize = tempSize
+
+        # kept for error reporting when a variable has no value
+        self.source = source
+        self.variablePositions = tuple(variablePositions) if variablePositions is not None else (0,) * len(variables)
+
+    # the derived tables below are built on first use, so loading a serialized program (see _serialize) keeps
+    # the mapped code as is and pays only for what its evaluations use
+
+    @cached_property
+    def instructions(self) -> tuple[tuple, ...]:
+        # arguments resolved ahead of time so the evaluator loop does no table lookups
+        return self._resolve(self.constants, self.functions)
+
+    @cached_property
+    def callCounts(self) -> Counter:
+        # (operator kind, symbol) -> calls per evaluation, for Metrics
+        code = self.code
+        return Counter(self.functionNames[code[i+1]] for i in range(0, len(code), 2) if code[i] in (CALL_UNARY, CALL_BINARY))
+
+    @cached_property
+    def scalarFunctions(self) -> tuple:
+        # variants of functions for the scalar execution mode
+        if self.scalarVariant is None:
+            return self.functions
+        return tuple(self.scalarVariant(kind, symbol, func) for (kind, symbol), func in zip(self.functionNames, self.functions))
+
+    @cached_property
+    def scalarInstructions(self) -> tuple[tuple, ...]:
+        # only resolved on the first scalar run, most programs never run in scalar mode
+        # numpy float constants become plain floats so scalar functions don't produce numpy scalars
+        return self._resolve([float(c) if isinstance(c, np.floating) else c for c in self.constants], self.scalarFunctions)
+
+    def _resolve(self, constants : tuple, functions : tuple) -> tuple[tuple, ...]:
+        resolved = []
+        code = self.code
+        for i in range(0, len(code), 2):
+            op, arg = code[i], code[i+1]
+            if op == LOAD_CONST:
+                resolved.append((op, constants[arg]))
+            elif op in (CALL_UNARY, CALL_BINARY):
+                resolved.append((op, functions[arg]))
+            else:
+                resolved.append((op, arg))
+        return tuple(resolved)
+
+    def __len__(self):
+        return len(self.code) // 2
+
+    def bind(self, variables : dict = None) -> list:
+        bound = []
+        for name, position in zip(self.variables, self.variablePositions):
+            if variables is None or name not in variables:
+                _throwEquationSyntaxErrorWIndex(self.source, position, f"No value given for variable: {{{name}}} !")
+            bound.append(variables[name])
+
+        return bound
+
+    def run(self, variables : dict = None, scalar : bool = False, deadline : float = None):
+        """ scalar runs the scalar variants of the functions, only valid when no variable is bound to an array
+        deadline is a perf_counter time, checked between instructions, see Limits.start
+        """
+        bound = self.bind(variables) if self.variables else None
+        stack = [None] * self.stackSize
+        temps = [None] * self.tempSize
+        sp = 0
+
+        instructions = self.scalarInstructions if scalar else self.instructions
+        if deadline is not None:
+            instructions = until(instructions, deadline)
+
+        for op, arg in instructions:
+            if op == LOAD_CONST:
+                stack[sp] = arg
+                sp += 1
+            elif op == CALL_BINARY:
+                sp -= 1
+                stack[sp-1] = arg(stack[sp-1], stack[sp])
+            elif op == CALL_UNARY:
+                stack[sp-1] = arg(stack[sp-1])
+            elif op == LOAD_VAR:
+                stack[sp] = bound[arg]
+                sp += 1
+            elif op == STORE_TEMP:
+                temps[arg] = stack[sp-1]
+            else:
+                stack[sp] = temps[arg]
+                sp += 1
+
+        return stack[0]
+
+    def disassemble(self) -> str:
+        lines = []
+        for i in range(0, len(self.code), 2):
+            op, arg = self.code[i], self.code[i+1]
+            if op == LOAD_CONST:
+                detail = repr(self.constants[arg])
+            elif op == LOAD_VAR:
+                detail = self.variables[arg]
+            elif op in (STORE_TEMP, LOAD_TEMP):
+                detail = f"t{arg}"
+            else:
+                detail = self.functionNames[arg][1]
+
+            lines.append(f"{i//2:>5} {OPNAMES[op]:<12} {arg:>4} ({detail})")
+
+        return "\n".join(lines)
+
+
+def tree_from_program(program : Program) -> Node:
+    """ Rebuild the tree a program was compiled from, subtrees kept in temporaries stay shared"""
+    stack = []
+    temps = [None] * program.tempSize
+    code = program.code
+    for i in range(0, len(code), 2):
+        op, arg = code[i], code[i+1]
+        if op == LOAD_CONST:
+            stack.append(ConstantNode(program.constants[arg]))
+        elif op == LOAD_VAR:
+            stack.append(VariableNode(program.variables[arg], program.source, program.variablePositions[arg]))
+        elif op == CALL_UNARY:
+            kind, symbol = program.functionNames[arg]
+            stack[-1] = UnaryOpNode(symbol, program.functions[arg], stack[-1], kind)
+        elif op == CALL_BINARY:
+            right = stack.pop()
+            stack[-1] = BinaryOpNode(program.functionNames[arg][1], program.functions[arg], stack[-1], right)
+        elif op == STORE_TEMP:
+            temps[arg] = stack[-1]
+        else:
+            stack.append(temps[arg])
+
+    return stack[-1]
+
+
+def _shared_nodes(tree : Node) -> set[int]:
+    # ids of operator nodes with more than one parent, the optimizer shares identical subtrees
+    seen = set()
+    shared = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, BinaryOpNode):
+            children = (node.leftOperand, node.rightOperand)
+        elif isinstance(node, UnaryOpNode):
+            children = (node.argument,)
+        else:
+            continue
+
+        for child in children:
+            if id(child) in seen:
+                shared.add(id(child))
+            else:
+                seen.add(id(child))
+                stack.append(child)
+
+    return shared
+
+
+def compile_program(tree : Node, source : str = "", scalar_variant : Callable = None) -> Program:
+    """ Lower a parsed tree into a postfix Program, iterative so deep trees are fine
+    subtrees shared by more than one parent are computed once and kept in a temporary slot
+    scalar_variant(kind, symbol, func) gives the function used in the scalar execution mode
+    """
+    code = array("i")
+    constants = []
+    functions = []
+    functionNames = []
+    functionIndex = {}
+    variables = []
+    variablePositions = []
+    variableIndex = {}
+
+    shared = _shared_nodes(tree)
+    tempSlots = {}
+
+    depth = 0
+    stackSize = 0
+
+    def function_slot(kind, symbol, func):
+        key = (kind, symbol)
+        if key not in functionIndex:
+            functionIndex[key] = len(functions)
+            functions.append(func)
+            functionNames.append(key)
+        return functionIndex[key]
+
+    def store_if_shared(node):
+        if id(node) in shared:
+            tempSlots[id(node)] = len(tempSlots)
+            code.extend((STORE_TEMP, tempSlots[id(node)]))
+
+    stack = [(tree, False)]
+    while stack:
+        node, visited = stack.pop()
+
+        if not visited and id(node) in tempSlots:
+            # already computed
+            code.extend((LOAD_TEMP, tempSlots[id(node)]))
+            depth += 1
+            stackSize = max(stackSize, depth)
+        elif isinstance(node, BinaryOpNode):
+            if visited:
+                code.extend((CALL_BINARY, function_slot(BINARY, node.operator, node.func)))
+                depth -= 1
+                store_if_shared(node)
+            else:
+                stack.append((node, True))
+                stack.append((node.rightOperand, False))
+                stack.append((node.leftOperand, False))
+        elif isinstance(node, UnaryOpNode):
+            if visited:
+                code.extend((CALL_UNARY, function_slot(node.kind, node.operator, node.func)))
+                store_if_shared(node)
+            else:
+                stack.append((node, True))
+                stack.append((node.argument, False))
+        else:
+            if isinstance(node, VariableNode):
+                if node.name not in variableIndex:
+                    variableIndex[node.name] = len(variables)
+                    variables.append(node.name)
+                    variablePositions.append(node.equationPosition)
+                code.extend((LOAD_VAR, variableIndex[node.name]))
+            else:
+                code.extend((LOAD_CONST, len(constants)))
+                constants.append(node.getValue())
+
+            depth += 1
+            stackSize = max(stackSize, depth)
+
+    return Program(code, constants, functions, functionNames, variables, stackSize, source, variablePositions, len(tempSlots), scalar_variant)
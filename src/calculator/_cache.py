@@ -0,0 +1,109 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """ Bounded mapping that evicts the least recently used entry, a maxsize of 0 disables it
+    safe to share between threads, the lock only guards the bookkeeping
+    """
+    def __init__(self, maxsize : int):
+        self.maxsize = maxsize
+        self.data : OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default = None):
+        with self.lock:
+            value = self.data.get(key, default)
+            if value is not default:
+                self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                # evict least recently used
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class LFUCache:
+    """ Bounded mapping that evicts the least frequently used entry, the least recently used of those on ties
+    same interface as LRUCache, safe to share between threads
+    """
+    def __init__(self, maxsize : int):
+        self.maxsize = maxsize
+        self.data : dict = {}
+        self.counts : dict = {}
+        # use count -> keys with that count, oldest first
+        self.buckets : dict[int, OrderedDict] = {}
+        self.minCount = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def _touch(self, key):
+        count = self.counts[key]
+        bucket = self.buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[count]
+            if self.minCount == count:
+                self.minCount = count + 1
+        self.counts[key] = count + 1
+        self.buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def get(self, key, default = None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            self._touch(key)
+            return self.data[key]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            if key in self.data:
+                self.data[key] = value
+                self._touch(key)
+                return
+
+            if len(self.data) >= self.maxsize:
+                # evict least frequently used
+                bucket = self.buckets[self.minCount]
+                evicted, _ = bucket.popitem(last=False)
+                if not bucket:
+                    del self.buckets[self.minCount]
+                del self.data[evicted]
+                del self.counts[evicted]
+
+            self.data[key] = value
+            self.counts[key] = 1
+            self.buckets.setdefault(1, OrderedDict())[key] = None
+            self.minCount = 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.counts.clear()
+            self.buckets.clear()
+            self.minCount = 0
@@ -0,0 +1,79 @@
+import ast
+import keyword
+from typing import Callable
+
+from ._bytecode import Program, LOAD_CONST, LOAD_VAR, CALL_UNARY, CALL_BINARY, STORE_TEMP
+
+# nested calls deeper than this are spilled into a local, the python compiler recurses on nested expressions
+_MAX_NESTING = 64
+
+
+def _parameter_names(variables : list[str]) -> list[str]:
+    # variables become the parameters, unless they could collide with keywords or the generated names
+    return [name if not keyword.iskeyword(name) and not name.startswith("_") else f"_v{i}" for i, name in enumerate(variables)]
+
+
+def _generate_module(program : Program, name : str) -> ast.Module:
+    parameters = _parameter_names(program.variables)
+
+    body = []
+    # (expression, nesting depth)
+    stack : list[tuple[ast.expr, int]] = []
+    temporaries = 0
+
+    def push(expression, depth):
+        nonlocal temporaries
+        if depth >= _MAX_NESTING:
+            temp = f"_t{temporaries}"
+            temporaries += 1
+            body.append(ast.Assign(targets=[ast.Name(temp, ast.Store())], value=expression))
+            expression, depth = ast.Name(temp, ast.Load()), 0
+        stack.append((expression, depth))
+
+    for op, arg in zip(program.code[::2], program.code[1::2]):
+        if op == LOAD_CONST:
+            stack.append((ast.Name(f"_c{arg}", ast.Load()), 0))
+        elif op == LOAD_VAR:
+            stack.append((ast.Name(parameters[arg], ast.Load()), 0))
+        elif op == CALL_UNARY:
+            operand, depth = stack.pop()
+            push(ast.Call(ast.Name(f"_f{arg}", ast.Load()), [operand], []), depth+1)
+        elif op == CALL_BINARY:
+            right, rightDepth = stack.pop()
+            left, leftDepth = stack.pop()
+            push(ast.Call(ast.Name(f"_f{arg}", ast.Load()), [left, right], []), max(leftDepth, rightDepth)+1)
+        elif op == STORE_TEMP:
+            # shared subexpression, computed once into a local
+            expression, _ = stack.pop()
+            body.append(ast.Assign(targets=[ast.Name(f"_s{arg}", ast.Store())], value=expression))
+            stack.append((ast.Name(f"_s{arg}", ast.Load()), 0))
+        else:
+            stack.append((ast.Name(f"_s{arg}", ast.Load()), 0))
+
+    result, _ = stack.pop()
+    body.append(ast.Return(ast.Call(ast.Name("_clip", ast.Load()), [result], [])))
+
+    # the function table and constants are bound as closure locals of a factory
+    bound = [f"_f{i}" for i in range(len(program.functions))] + [f"_c{i}" for i in range(len(program.constants))] + ["_clip"]
+    module = ast.parse(f"def _factory({', '.join(bound)}):\n"
+                       f"    def {name}({', '.join(parameters)}):\n"
+                       f"        pass\n"
+                       f"    return {name}\n")
+    module.body[0].body[0].body = body
+
+    return ast.fix_missing_locations(module)
+
+
+def generate_source(program : Program, name : str = "f") -> str:
+    """ Python source for a program: def f(a, b): return _clip(_f0(_f1(a), _c0))"""
+    return ast.unparse(_generate_module(program, name))
+
+
+def generate_function(program : Program, clip : Callable, name : str = "f") -> Callable:
+    """ Compile a program into a native python function taking the variables as positional arguments, in program order"""
+    namespace = {}
+    exec(compile(_generate_module(program, name), f"<calculator {program.source}>", "exec"), namespace)
+
+    function = namespace["_factory"](*program.functions, *program.constants, clip)
+    function.__doc__ = program.source
+    return function
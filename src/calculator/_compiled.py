@@ -0,0 +1,100 @@
+import numpy as np
+
+from ._nodes import Node
+from ._bytecode import Program, tree_from_program
+from ._parallel import run_blocked, BLOCK_SIZE
+from ._dtypes import FLOAT64, cast_variable, cast_output
+from ._serialize import dump_program
+from ._autodiff import forward
+
+
+class CompiledExpression:
+    """ A parsed and validated expression, can be evaluated any number of times without reparsing"""
+    __slots__ = ("_calculator", "_source", "_tree", "_program", "_dtype")
+
+    def __init__(self, calculator, source : str, tree : Node, program : Program, dtype : np.dtype = FLOAT64):
+        object.__setattr__(self, "_calculator", calculator)
+        object.__setattr__(self, "_source", source)
+        object.__setattr__(self, "_tree", tree)
+        object.__setattr__(self, "_program", program)
+        object.__setattr__(self, "_dtype", dtype)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledExpression is immutable!")
+
+    def __repr__(self):
+        return f"CompiledExpression({self._source!r})"
+
+    @property
+    def source(self) -> str:
+        return self._source
+
+    @property
+    def tree(self) -> Node:
+        if self._tree is None:
+            # loaded expressions (see Calculator.load_bytes) rebuild their tree on first use
+            object.__setattr__(self, "_tree", tree_from_program(self._program))
+        return self._tree
+
+    @property
+    def program(self) -> Program:
+        return self._program
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    @property
+    def variables(self) -> tuple[str, ...]:
+        return self._program.variables
+
+    def evaluate(self, /, **variables):
+        """ Evaluate with the given variable bindings, values can be scalars or numpy arrays (broadcast together)"""
+        metrics = self._calculator.metrics
+        if metrics is None:
+            return self._evaluate(variables)
+
+        result = metrics.measure("evaluate", self._evaluate, variables)
+        metrics.record_calls(self._program)
+        return result
+
+    def _evaluate(self, variables : dict):
+        calc = self._calculator
+        dtype = self._dtype
+        if dtype != FLOAT64:
+            variables = {name: cast_variable(value, dtype) for name, value in variables.items()}
+
+        # scalar mode only applies to plain floats, when nothing is bound to an array (or a list or tuple)
+        scalar = calc.scalarMode and dtype == FLOAT64 and all(isinstance(value, (float, int)) or np.ndim(value) == 0 for value in variables.values())
+
+        deadline = calc.limits.start(self._program, variables) if calc.limits is not None else None
+        return cast_output(calc.clip_output(self._program.run(variables, scalar, deadline)), dtype)
+
+    def evaluate_parallel(self, variables : dict, workers : int = None, block_size : int = BLOCK_SIZE):
+        """ Evaluate over large arrays in cache sized blocks on a thread pool, same results and dtype as evaluate"""
+        dtype = self._dtype
+        if dtype != FLOAT64:
+            variables = {name: cast_variable(value, dtype) for name, value in variables.items()}
+        if self._calculator.limits is not None:
+            # the step budget covers every block, the time budget only applies to evaluate
+            self._calculator.limits.start(self._program, variables)
+        return cast_output(run_blocked(self._program, variables, self._calculator.clip_output, workers, block_size, dtype), dtype)
+
+    def gradient(self, wrt, /, **variables) -> tuple:
+        """ Value and partial derivatives with respect to the variables named in wrt, in one forward pass
+        works on scalars and numpy arrays, a variable the expression doesn't use has a zero partial
+        """
+        calc = self._calculator
+        program = self._program
+        wrt = (wrt,) if isinstance(wrt, str) else tuple(wrt)
+        derivatives = [calc._derivative_rule(kind, symbol, func) for (kind, symbol), func in zip(program.functionNames, program.functions)]
+        value, partials = forward(program, derivatives, variables, wrt)
+        return calc.clip_output(value), partials
+
+    def to_bytes(self) -> bytes:
+        """ Versioned binary form of the compiled program, see Calculator.load_bytes"""
+        return dump_program(self._program, self._calculator, self._dtype)
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
@@ -0,0 +1,68 @@
+from ._utils import _formatEquationError
+
+# diagnostic codes, one per syntax error description
+INVALID_SEPARATORS = "invalid_separators"
+MISSING_OPERATOR_ARGUMENTS = "missing_operator_arguments"
+EMPTY_SEPARATORS = "empty_separators"
+MISSING_OPERAND = "missing_operand"
+MISSING_BINARY_OPERATOR = "missing_binary_operator"
+MISSING_OPERATOR_SEPARATORS = "missing_operator_separators"
+INVALID_OPERATOR_SEPARATORS = "invalid_operator_separators"
+MULTIPLE_BINARY_OPERATORS = "multiple_binary_operators"
+INVALID_BINARY_OPERATOR = "invalid_binary_operator"
+INVALID_SUFFIX = "invalid_suffix"
+INVALID_SEPARATOR_LEVEL = "invalid_separator_level"
+INVALID_VALUE = "invalid_value"
+EMPTY_EXPRESSION = "empty_expression"
+
+
+class Diagnostic:
+    """ One problem found by Calculator.validate, offset is where the error message points and start:end the span of
+    the offending token, all in the input as given (source), so they can highlight it directly.
+    expression is the input with spaces stripped, as the calculator reads it, and expressionOffset the offset in it,
+    message is only formatted when asked for
+    """
+    __slots__ = ("code", "offset", "start", "end", "source", "description", "expression", "expressionOffset")
+
+    def __init__(self, code : str, offset : int, start : int, end : int, source : str, description : str, expression : str = None, expressionOffset : int = None):
+        self.code = code
+        self.offset = offset
+        self.start = start
+        self.end = end
+        self.source = source
+        self.description = description
+        self.expression = source if expression is None else expression
+        self.expressionOffset = offset if expressionOffset is None else expressionOffset
+
+    @property
+    def span(self) -> tuple[int, int]:
+        return (self.start, self.end)
+
+    @property
+    def message(self) -> str:
+        """ Same text as the SyntaxError calculate raises for this problem"""
+        if self.code == EMPTY_EXPRESSION:
+            return self.description
+        return _formatEquationError(self.expression, self.expressionOffset, self.description)
+
+    def __repr__(self):
+        return f"Diagnostic({self.code!r}, {self.offset}, {self.span}, {self.description!r})"
+
+
+def locate(diagnostics : list[Diagnostic], source : str, expression : str) -> list[Diagnostic]:
+    """ The diagnostics of the stripped expression with their offsets and spans moved to the input it came from"""
+    # raw index of every character of the expression, which is source with some spaces removed
+    positions = []
+    j = 0
+    for i, c in enumerate(source):
+        if j < len(expression) and c == expression[j]:
+            positions.append(i)
+            j += 1
+    positions.append(len(source))
+
+    located = []
+    for d in diagnostics:
+        # end is exclusive, so it follows the last character of the span
+        end = positions[d.end-1] + 1 if d.end > d.start else positions[d.start]
+        located.append(Diagnostic(d.code, positions[d.offset], positions[d.start], end, source, d.description, expression, d.offset))
+    return located
@@ -0,0 +1,55 @@
+"""
+Numeric dtypes a calculator can evaluate in, and how values are materialized in them.
+
+float64 is the default and leaves values as they are (python floats, so the scalar mode applies).
+float32: literals, constants and variables are converted to float32, numpy keeps float32 through every ufunc,
+    and the output is float32.
+int64: integral literals, constants and variables are int64 and +, -, *, %, ^, abs, negation and ! stay int64.
+    / and functions like sqrt, sin or log promote to float64 as in numpy, as do non integral literals or
+    constants (eg pi), so the output is int64 unless something promoted it. Integers to negative integer
+    powers raise, as in numpy, and overflow wraps around.
+"""
+import numpy as np
+
+FLOAT32 = np.dtype(np.float32)
+FLOAT64 = np.dtype(np.float64)
+INT64 = np.dtype(np.int64)
+DTYPES = (FLOAT32, FLOAT64, INT64)
+
+
+def resolve_dtype(dtype) -> np.dtype:
+    try:
+        resolved = np.dtype(dtype)
+    except TypeError:
+        resolved = None
+    if resolved not in DTYPES:
+        raise ValueError("Dtype must be float32, float64 or int64!")
+    return resolved
+
+
+def materialize(value, dtype : np.dtype):
+    """ A literal or constant in the calculator's dtype"""
+    if dtype == FLOAT64:
+        return value
+    if dtype == INT64 and not float(value).is_integer():
+        # stays float64 and promotes what it touches
+        return np.float64(value)
+    return dtype.type(value)
+
+
+def cast_variable(value, dtype : np.dtype):
+    if dtype == FLOAT64:
+        return value
+    # same_kind refuses to truncate floats into an int64 calculator
+    cast = np.asarray(value).astype(dtype, casting="same_kind", copy=False)
+    return cast if cast.ndim else cast[()]
+
+
+def cast_output(value, dtype : np.dtype):
+    if dtype == FLOAT64:
+        return value
+    if dtype == INT64 and np.asarray(value).dtype.kind not in "iub":
+        # promoted by / or a float function
+        return value
+    cast = np.asarray(value).astype(dtype, copy=False)
+    return cast if cast.ndim else cast[()]
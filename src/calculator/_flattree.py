@@ -0,0 +1,153 @@
+import numpy as np
+
+from ._nodes import Node, ConstantNode, VariableNode, UnaryOpNode, BinaryOpNode, BINARY
+
+# node opcodes
+CONSTANT = 0   # argument: index into constants
+VARIABLE = 1   # argument: index into variables
+UNARY_OP = 2   # argument: index into functions, child in left
+BINARY_OP = 3  # argument: index into functions, children in left and right
+
+
+class FlatTree:
+    """ Struct of arrays storage for a parsed tree, one entry per node in typed numpy buffers
+    nodes are in post-order so children come before their parents and the root is last,
+    a subtree shared by several parents (see Optimizer) is stored once
+    """
+    def __init__(
+        self,
+        opcodes : np.ndarray,
+        arguments : np.ndarray,
+        left : np.ndarray,
+        right : np.ndarray,
+        constants : np.ndarray,
+        variables : tuple[str, ...],
+        variablePositions : tuple[int, ...],
+        functions : tuple,
+        functionNames : tuple[tuple[str, str], ...],
+        source : str = "",
+    ):
+        self.opcodes = opcodes
+        self.arguments = arguments
+        # child node indices, -1 where there is none
+        self.left = left
+        self.right = right
+        self.constants = constants
+        self.variables = variables
+        self.variablePositions = variablePositions
+        self.functions = functions
+        # (operator kind, symbol) for every entry in functions
+        self.functionNames = functionNames
+        self.source = source
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    @property
+    def nbytes(self) -> int:
+        """ Size of the node buffers and constant pool"""
+        return self.opcodes.nbytes + self.arguments.nbytes + self.left.nbytes + self.right.nbytes + self.constants.nbytes
+
+    @classmethod
+    def from_tree(cls, tree : Node, source : str = "") -> "FlatTree":
+        opcodes, arguments, left, right = [], [], [], []
+        constants = []
+        variables, variablePositions, variableIndex = [], [], {}
+        functions, functionNames, functionIndex = [], [], {}
+        # id(node) -> index, so shared subtrees are stored once
+        index : dict[int, int] = {}
+
+        def add(opcode, argument, leftChild=-1, rightChild=-1):
+            opcodes.append(opcode)
+            arguments.append(argument)
+            left.append(leftChild)
+            right.append(rightChild)
+
+        def function_slot(kind, symbol, func):
+            if (kind, symbol) not in functionIndex:
+                functionIndex[(kind, symbol)] = len(functions)
+                functions.append(func)
+                functionNames.append((kind, symbol))
+            return functionIndex[(kind, symbol)]
+
+        stack = [(tree, False)]
+        while stack:
+            node, visited = stack.pop()
+            if id(node) in index:
+                continue
+
+            if isinstance(node, BinaryOpNode):
+                if not visited:
+                    stack.append((node, True))
+                    stack.append((node.rightOperand, False))
+                    stack.append((node.leftOperand, False))
+                    continue
+                add(BINARY_OP, function_slot(BINARY, node.operator, node.func), index[id(node.leftOperand)], index[id(node.rightOperand)])
+            elif isinstance(node, UnaryOpNode):
+                if not visited:
+                    stack.append((node, True))
+                    stack.append((node.argument, False))
+                    continue
+                add(UNARY_OP, function_slot(node.kind, node.operator, node.func), index[id(node.argument)])
+            elif isinstance(node, VariableNode):
+                if node.name not in variableIndex:
+                    variableIndex[node.name] = len(variables)
+                    variables.append(node.name)
+                    variablePositions.append(node.equationPosition)
+                add(VARIABLE, variableIndex[node.name])
+            else:
+                add(CONSTANT, len(constants))
+                constants.append(node.value)
+
+            index[id(node)] = len(opcodes) - 1
+
+        if all(type(c) is float or type(c) is np.float64 for c in constants):
+            constantPool = np.array(constants, dtype=np.float64)
+        else:
+            # other dtypes (see _dtypes) keep their exact types
+            constantPool = np.empty(len(constants), dtype=object)
+            constantPool[:] = constants
+
+        return cls(np.array(opcodes, dtype=np.int8), np.array(arguments, dtype=np.int32),
+                   np.array(left, dtype=np.int32), np.array(right, dtype=np.int32), constantPool,
+                   tuple(variables), tuple(variablePositions), tuple(functions), tuple(functionNames), source)
+
+    def to_tree(self) -> Node:
+        """ Rebuild linked nodes, shared subtrees stay shared"""
+        nodes = []
+        constants = self.constants.tolist()
+        for opcode, argument, left, right in zip(self.opcodes.tolist(), self.arguments.tolist(), self.left.tolist(), self.right.tolist()):
+            if opcode == CONSTANT:
+                nodes.append(ConstantNode(constants[argument]))
+            elif opcode == VARIABLE:
+                nodes.append(VariableNode(self.variables[argument], self.source, self.variablePositions[argument]))
+            elif opcode == UNARY_OP:
+                kind, symbol = self.functionNames[argument]
+                nodes.append(UnaryOpNode(symbol, self.functions[argument], nodes[left], kind))
+            else:
+                nodes.append(BinaryOpNode(self.functionNames[argument][1], self.functions[argument], nodes[left], nodes[right]))
+
+        return nodes[-1]
+
+    def evaluate(self, variables : dict = None):
+        """ Evaluate every node in order, same results as collapse on the linked tree"""
+        bound = []
+        for name, position in zip(self.variables, self.variablePositions):
+            if variables is None or name not in variables:
+                VariableNode(name, self.source, position).getValue(variables)
+            bound.append(variables[name])
+
+        constants = self.constants.tolist()
+        functions = self.functions
+        values = []
+        for opcode, argument, left, right in zip(self.opcodes.tolist(), self.arguments.tolist(), self.left.tolist(), self.right.tolist()):
+            if opcode == CONSTANT:
+                values.append(constants[argument])
+            elif opcode == VARIABLE:
+                values.append(bound[argument])
+            elif opcode == UNARY_OP:
+                values.append(functions[argument](values[left]))
+            else:
+                values.append(functions[argument](values[left], values[right]))
+
+        return values[-1]
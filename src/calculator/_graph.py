@@ -0,0 +1,187 @@
+import heapq
+
+import numpy as np
+
+from ._compiled import CompiledExpression
+
+
+def _same(old, new) -> bool:
+    # cutoff for propagation, arrays compare element-wise
+    if isinstance(old, np.ndarray) or isinstance(new, np.ndarray):
+        return isinstance(old, np.ndarray) and isinstance(new, np.ndarray) and old.shape == new.shape and np.array_equal(old, new)
+    return old is new or old == new
+
+
+class FormulaGraph:
+    """ Named formulas that refer to each other and to inputs by variable name, eg
+    g.define("area", "w*h"); g.define("volume", "area*d"); g.set_inputs(w=2, h=3, d=4); g["volume"]
+
+    changing an input or a formula only recomputes the formulas downstream of it, in topological order,
+    and stops propagating where a recomputed value did not change
+    """
+    def __init__(self, calculator):
+        self.calculator = calculator
+        self.formulas : dict[str, CompiledExpression] = {}
+        self.inputs : dict = {}
+        # last computed value of every formula
+        self.values : dict = {}
+        # name -> formulas that use it
+        self.dependents : dict[str, set[str]] = {}
+        # 0 for formulas only using inputs, else one more than their deepest dependency, so a heap ordered by level is topological
+        self.levels : dict[str, int] = {}
+        # formulas defined or rewired since levels were last updated, see _update_levels
+        self.stale : set[str] = set()
+        self.pending : set[str] = set()
+
+    def __contains__(self, name : str) -> bool:
+        return name in self.formulas or name in self.inputs
+
+    def __getitem__(self, name : str):
+        if name in self.inputs:
+            return self.inputs[name]
+        if name not in self.formulas:
+            raise KeyError(name)
+
+        self.recompute()
+        return self.values[name]
+
+    def _cycle(self, name : str, dependencies : tuple[str, ...]) -> list[str]:
+        # path from name back to name through the new dependencies, or None
+        # a new dependency closes a cycle only if it already depends on name, so search downstream of name (dependents)
+        # and upstream of the dependencies (formula variables) together, a level at a time on the smaller side,
+        # so defining a formula costs the smaller of the two searches rather than everything upstream of it
+        if name in dependencies:
+            return [name, name]
+
+        # node -> the node it was reached from
+        down : dict[str, str] = {name: None}
+        # inputs and undefined names have nothing upstream, so only formulas (and name, which may be new) are searched
+        up : dict[str, str] = {dependency: None for dependency in dependencies if dependency in self.formulas}
+        downFrontier, upFrontier = [name], list(up)
+        while downFrontier and upFrontier:
+            frontier = []
+            if len(downFrontier) <= len(upFrontier):
+                for current in downFrontier:
+                    for dependent in self.dependents.get(current, ()):
+                        if dependent not in down:
+                            down[dependent] = current
+                            if dependent in up:
+                                return self._cycle_path(name, dependent, down, up)
+                            frontier.append(dependent)
+                downFrontier = frontier
+            else:
+                for current in upFrontier:
+                    for dependency in self.formulas[current].variables:
+                        if dependency not in up and (dependency in self.formulas or dependency == name):
+                            up[dependency] = current
+                            if dependency in down:
+                                return self._cycle_path(name, dependency, down, up)
+                            frontier.append(dependency)
+                upFrontier = frontier
+        return None
+
+    @staticmethod
+    def _cycle_path(name : str, meeting : str, down : dict, up : dict) -> list[str]:
+        # name -> new dependency -> ... -> meeting -> ... -> name, each formula followed by one it uses
+        toDependency = []
+        current = meeting
+        while current is not None:
+            toDependency.append(current)
+            current = up[current]
+        toName = []
+        current = down[meeting]
+        while current is not None:
+            toName.append(current)
+            current = down[current]
+        return [name, *reversed(toDependency), *toName]
+
+    def _update_levels(self):
+        # relevel everything downstream of the formulas changed since the last recompute, once, in topological order
+        # formulas outside that subgraph keep their levels, nothing upstream of them changed
+        affected = set()
+        stack = [name for name in self.stale if name in self.formulas]
+        while stack:
+            current = stack.pop()
+            if current not in affected:
+                affected.add(current)
+                stack.extend(self.dependents.get(current, ()))
+        self.stale.clear()
+
+        # dependencies inside the subgraph still to be leveled
+        remaining = {name: sum(1 for d in self.formulas[name].variables if d in affected) for name in affected}
+        ready = [name for name, count in remaining.items() if count == 0]
+        while ready:
+            current = ready.pop()
+            self.levels[current] = max((self.levels[d] + 1 for d in self.formulas[current].variables if d in self.formulas), default=0)
+            for dependent in self.dependents.get(current, ()):
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    ready.append(dependent)
+
+    def define(self, name : str, expression : str):
+        """ Add or replace a formula, raises ValueError if it would make a cycle"""
+        if name in self.inputs:
+            raise ValueError(f"{name} is already an input!")
+
+        compiled = self.calculator.compile(expression)
+        path = self._cycle(name, compiled.variables)
+        if path is not None:
+            raise ValueError(f"Formula cycle: {' -> '.join(path)} !")
+
+        if name in self.formulas:
+            for dependency in self.formulas[name].variables:
+                self.dependents[dependency].discard(name)
+        for dependency in compiled.variables:
+            self.dependents.setdefault(dependency, set()).add(name)
+
+        self.formulas[name] = compiled
+        self.stale.add(name)
+        self.pending.add(name)
+
+    def remove(self, name : str):
+        """ Remove a formula, formulas that use it need a new definition or an input of that name"""
+        compiled = self.formulas.pop(name)
+        for dependency in compiled.variables:
+            self.dependents[dependency].discard(name)
+        self.values.pop(name, None)
+        self.levels.pop(name, None)
+        self.pending.discard(name)
+        self.stale.discard(name)
+        self.stale.update(self.dependents.get(name, ()))
+        self.pending.update(self.dependents.get(name, ()))
+
+    def set_inputs(self, **values):
+        for name, value in values.items():
+            if name in self.formulas:
+                raise ValueError(f"{name} is a formula, not an input!")
+            self.inputs[name] = value
+            self.pending.update(self.dependents.get(name, ()))
+
+    def recompute(self) -> list[str]:
+        """ Evaluate the formulas affected since the last recompute, returns their names in evaluation order"""
+        if self.stale:
+            self._update_levels()
+        heap = [(self.levels[name], name) for name in self.pending]
+        heapq.heapify(heap)
+        queued = set(self.pending)
+        recomputed = []
+
+        while heap:
+            _, name = heapq.heappop(heap)
+            compiled = self.formulas[name]
+            variables = {d: self.values[d] if d in self.formulas else self.inputs[d] for d in compiled.variables if d in self.formulas or d in self.inputs}
+            # an unbound name raises the usual "No value given for variable" SyntaxError, the rest stay pending
+            value = compiled.evaluate(**variables)
+            self.pending.discard(name)
+            recomputed.append(name)
+
+            if name in self.values and _same(self.values[name], value):
+                continue
+            self.values[name] = value
+            for dependent in self.dependents.get(name, ()):
+                if dependent not in queued:
+                    queued.add(dependent)
+                    self.pending.add(dependent)
+                    heapq.heappush(heap, (self.levels[dependent], dependent))
+
+        return recomputed
@@ -0,0 +1,178 @@
+import re
+from string import ascii_letters, digits
+from typing import Iterable, Optional
+
+# token kinds
+NUMBER = "number"
+IDENTIFIER = "identifier"
+OPERATOR = "operator"
+SEPARATOR = "separator"
+SUFFIX = "suffix"
+# a negation character that is not part of a number/name, eg -(1+2) or -sin(1)
+NEGATION = "negation"
+
+_NUMBER_START = set("0123456789.")
+# names start with a letter or underscore and run over letters, digits and underscores
+_NAME_START = set(ascii_letters + "_")
+_NAME = set(ascii_letters + digits + "_")
+
+_SPACES = re.compile(" +")
+
+
+def _squeeze(match : re.Match) -> str:
+    text = match.string
+    before = text[match.start()-1] if match.start() > 0 else ""
+    after = text[match.end()] if match.end() < len(text) else ""
+    # a space between two names (or a name and a number) separates them, eg "one plus two", the rest are dropped
+    if before in _NAME and after in _NAME and (before in _NAME_START or after in _NAME_START):
+        return " "
+    return ""
+
+
+def strip_spaces(input_str : str) -> str:
+    """ Drop spaces, except one where it separates two names, eg "2 * cos(t)" -> "2*cos(t)", "one plus two" is kept"""
+    return _SPACES.sub(_squeeze, input_str) if " " in input_str else input_str
+
+
+class Token:
+    __slots__ = ("kind", "text", "start", "end")
+
+    def __init__(self, kind : str, text : str, start : int, end : int):
+        self.kind = kind
+        self.text = text
+        # span in the input string, [start, end)
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"Token({self.kind}, {self.text!r}, {self.start}, {self.end})"
+
+
+class Lexer:
+    """ Single pass lexer, operators are matched longest first at every position, except inside names:
+    a name (letter or underscore, then letters, digits and underscores) is one token, an operator only if all of it is one,
+    so "cost" is a variable rather than cos followed by t, unless it follows a value, where a name can't go, eg "(1+2)x3"
+    """
+    def __init__(self, operators : Iterable[str], suffixoperators : Iterable[str], negationChar : str, openSeparator : str, closeSeparator : str):
+        self.negationChar = negationChar
+        self.separators = {openSeparator, closeSeparator}
+        self.closeSeparator = closeSeparator
+        self.suffixes = set(suffixoperators)
+
+        self.operators = set(operators)
+        # longest match table, first character -> candidate operators, longest first
+        self.operatorTable : dict[str, list[str]] = {}
+        for op in self.operators:
+            self.operatorTable.setdefault(op[0], []).append(op)
+        for candidates in self.operatorTable.values():
+            candidates.sort(key=len, reverse=True)
+
+    def matchOperator(self, input_str : str, index : int) -> Optional[str]:
+        candidates = self.operatorTable.get(input_str[index])
+        if candidates is not None:
+            for op in candidates:
+                if input_str.startswith(op, index):
+                    return op
+
+        return None
+
+    def _wordToken(self, input_str : str, start : int, end : int) -> Token:
+        text = input_str[start:end]
+        if text == self.negationChar:
+            return Token(NEGATION, text, start, end)
+
+        first = text[0]
+        if first == self.negationChar and len(text) > 1:
+            first = text[1]
+
+        return Token(NUMBER if first in _NUMBER_START else IDENTIFIER, text, start, end)
+
+    def _afterValue(self, tokens : list[Token]) -> bool:
+        if not tokens:
+            return False
+        last = tokens[-1]
+        return last.kind in (NUMBER, IDENTIFIER, SUFFIX) or last.text == self.closeSeparator
+
+    def tokenize(self, input_str : str) -> list[Token]:
+        tokens = []
+        input_len = len(input_str)
+        # start of the current number/identifier
+        wordStart = None
+        # negation is only special at the start or directly after another operator, separators do not count
+        # so 3(-5) is still a subtraction while 3*(-5) is a negative literal
+        lastTokenOperator = True
+
+        i = 0
+        while i < input_len:
+            c = input_str[i]
+
+            if c == " ":
+                # only left between names by strip_spaces
+                if wordStart is not None:
+                    tokens.append(self._wordToken(input_str, wordStart, i))
+                    wordStart = None
+                i += 1
+                continue
+
+            # a bare negation is checked by its length, so long numbers aren't sliced for every letter in them
+            if c in _NAME_START and (wordStart is None or (i - wordStart == 1 and input_str[wordStart] == self.negationChar)):
+                end = i + 1
+                while end < input_len and input_str[end] in _NAME:
+                    end += 1
+
+                op = input_str[i:end] if input_str[i:end] in self.operators else None
+                if op is None and wordStart is None and self._afterValue(tokens):
+                    # a name can't follow a value, so split a leading operator off, eg "pi x2" or "sin(0)x2"
+                    op = self.matchOperator(input_str, i)
+
+                if op is not None:
+                    if wordStart is not None:
+                        tokens.append(self._wordToken(input_str, wordStart, i))
+                        wordStart = None
+                    end = i + len(op)
+                    tokens.append(Token(OPERATOR, op, i, end))
+                    lastTokenOperator = True
+                else:
+                    # a name, or a negated one
+                    if wordStart is None:
+                        wordStart = i
+                    lastTokenOperator = False
+                i = end
+                continue
+
+            op = self.matchOperator(input_str, i)
+            if op is not None and not (op == self.negationChar and lastTokenOperator):
+                if wordStart is not None:
+                    tokens.append(self._wordToken(input_str, wordStart, i))
+                    wordStart = None
+
+                tokens.append(Token(OPERATOR, op, i, i+len(op)))
+                lastTokenOperator = True
+                i += len(op)
+                continue
+
+            if c in self.separators or c in self.suffixes:
+                if wordStart is not None:
+                    token = self._wordToken(input_str, wordStart, i)
+                    tokens.append(token)
+                    wordStart = None
+                    # a bare negation counts as an operator, so the negation in -(-1) is still a negative literal
+                    lastTokenOperator = token.kind == NEGATION
+
+                if c in self.separators:
+                    tokens.append(Token(SEPARATOR, c, i, i+1))
+                else:
+                    tokens.append(Token(SUFFIX, c, i, i+1))
+                    lastTokenOperator = False
+            else:
+                # normal char, part of a number/constant/variable (or a leading negation)
+                if wordStart is None:
+                    wordStart = i
+                lastTokenOperator = False
+
+            i += 1
+
+        if wordStart is not None:
+            tokens.append(self._wordToken(input_str, wordStart, input_len))
+
+        return tokens
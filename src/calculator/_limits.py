@@ -0,0 +1,127 @@
+import functools
+from math import prod
+from time import perf_counter
+
+import numpy as np
+
+
+class ResourceLimitError(ValueError):
+    """ An expression or one of its evaluations went over a limit set with CalculatorBuilder.setLimits, or failed an operator guard"""
+    def __init__(self, message : str, limit : str):
+        super().__init__(message)
+        # eg "maxTokens" or "guard", used to count errors by kind
+        self.limit = limit
+        self.category = limit
+
+    def __reduce__(self):
+        # rebuilt from both arguments, so it can come back from a worker process
+        return (ResourceLimitError, (str(self), self.limit))
+
+
+class Limits:
+    """ Bounds on the size of an expression and the cost of evaluating it, None means unlimited
+    size limits are checked as soon as each stage can tell, so a hostile input is rejected before the costly stages run
+    """
+    __slots__ = ("maxInputLength", "maxTokens", "maxDepth", "maxNodes", "maxSteps", "timeBudget")
+
+    def __init__(self, maxInputLength : int = None, maxTokens : int = None, maxDepth : int = None, maxNodes : int = None, maxSteps : int = None, timeBudget : float = None):
+        for name, value in (("maxInputLength", maxInputLength), ("maxTokens", maxTokens), ("maxDepth", maxDepth), ("maxNodes", maxNodes), ("maxSteps", maxSteps), ("timeBudget", timeBudget)):
+            if value is not None and value <= 0:
+                raise ValueError(f"Limit {name} must be positive!")
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return f"Limits({', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__ if getattr(self, name) is not None)})"
+
+    @staticmethod
+    def _exceeded(limit : str, what : str, maximum, value = None):
+        found = f": {value} " if value is not None else ""
+        raise ResourceLimitError(f"{what} exceeds the limit of {maximum}{found}!", limit)
+
+    def check_input(self, raw_input : str):
+        # before stripping, so even the whitespace of a huge input isn't scanned
+        if self.maxInputLength is not None and len(raw_input) > self.maxInputLength:
+            self._exceeded("maxInputLength", "Input length", self.maxInputLength, len(raw_input))
+
+    def check_tokens(self, tokens : list, openSeparator : str, closeSeparator : str):
+        if self.maxTokens is not None and len(tokens) > self.maxTokens:
+            self._exceeded("maxTokens", "Token count", self.maxTokens, len(tokens))
+
+        if self.maxDepth is not None:
+            # unary operator arguments are always separated, so separator depth is the nesting depth
+            depth = 0
+            for token in tokens:
+                if token.text == openSeparator:
+                    depth += 1
+                    if depth > self.maxDepth:
+                        self._exceeded("maxDepth", "Nesting depth", self.maxDepth)
+                elif token.text == closeSeparator:
+                    depth -= 1
+
+    def check_nodes(self, tree):
+        # counted before constant folding, which runs the operators
+        if self.maxNodes is None:
+            return
+        count = 0
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            count += 1
+            if count > self.maxNodes:
+                self._exceeded("maxNodes", "Node count", self.maxNodes)
+            # BinaryOpNode / UnaryOpNode children, without importing the node classes
+            for child in ("leftOperand", "rightOperand", "argument"):
+                child = getattr(node, child, None)
+                if child is not None:
+                    stack.append(child)
+
+    def start(self, program, variables : dict) -> float:
+        """ Check the step budget of an evaluation and give its deadline (None without a time budget)
+        a program has no branches, so its steps are its instructions times the elements they run over, known before it starts
+        """
+        if self.maxSteps is not None:
+            # the broadcast size, eg (N, 1) and (1, N) inputs run over N*N elements
+            elements = prod(np.broadcast_shapes(*(np.shape(variables[name]) for name in program.variables if name in variables)))
+            steps = len(program) * elements
+            if steps > self.maxSteps:
+                self._exceeded("maxSteps", "Evaluation steps", self.maxSteps, steps)
+
+        return self.deadline()
+
+    def deadline(self) -> float:
+        """ perf_counter time the time budget runs out at if it starts now, None without one"""
+        return perf_counter() + self.timeBudget if self.timeBudget is not None else None
+
+
+def until(instructions, deadline : float):
+    """ The instructions, raising once the deadline has passed"""
+    for instruction in instructions:
+        if perf_counter() > deadline:
+            raise ResourceLimitError("Evaluation exceeded its time budget!", "timeBudget")
+        yield instruction
+
+
+class GuardedFunction:
+    """ Operator function that checks its arguments first, see CalculatorBuilder guard"""
+    def __init__(self, func, guard, symbol : str):
+        self.func = func
+        self.guard = guard
+        self.symbol = symbol
+        # updated=() keeps the wrapped function's attributes (eg its own func) off this wrapper
+        functools.update_wrapper(self, func, updated=())
+
+    def __reduce__(self):
+        return (GuardedFunction, (self.func, self.guard, self.symbol))
+
+    def __repr__(self):
+        return f"GuardedFunction({self.func!r}, {self.guard!r}, {self.symbol!r})"
+
+    def __call__(self, *args):
+        # element-wise guards reject an array if any element fails
+        if not np.all(self.guard(*args)):
+            raise ResourceLimitError(f"Argument out of range for operator: {{{self.symbol}}} !", "guard")
+        return self.func(*args)
+
+
+def guarded(func, guard, symbol : str):
+    return func if guard is None else GuardedFunction(func, guard, symbol)
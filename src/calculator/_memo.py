@@ -0,0 +1,85 @@
+import functools
+
+import numpy as np
+
+from ._cache import LRUCache, LFUCache
+
+POLICIES = {"lru": LRUCache, "lfu": LFUCache}
+
+_MISSING = object()
+
+
+def _key(args : tuple):
+    # arguments as a cache key, None when they can't be cached
+    key = []
+    for arg in args:
+        if isinstance(arg, np.ndarray):
+            if arg.ndim:
+                # arrays are too costly to hash and rarely repeat, they skip the cache
+                return None
+            arg = arg[()]
+        if isinstance(arg, (float, np.floating)):
+            # float.hex tells -0.0 and 0.0 apart, they can give different results (eg 1/x)
+            key.append((type(arg), float.hex(float(arg))))
+        else:
+            try:
+                hash(arg)
+            except TypeError:
+                return None
+            key.append((type(arg), arg))
+    return tuple(key)
+
+
+class MemoizedFunction:
+    """ Operator function with a bounded cache of results keyed on its argument values, see CalculatorBuilder memoize"""
+    def __init__(self, func, policy : str = "lru", maxsize : int = 128):
+        if policy not in POLICIES:
+            raise ValueError('Memoize policy must be "lru" or "lfu"!')
+        if maxsize < 1:
+            raise ValueError("Memoize size must be at least 1!")
+
+        self.func = func
+        self.policy = policy
+        self.maxsize = maxsize
+        self.cache = POLICIES[policy](maxsize)
+        self.hits = 0
+        self.misses = 0
+        # calls with array arguments, not cached
+        self.skipped = 0
+        # updated=() keeps the wrapped function's attributes (eg its own func) off this wrapper
+        functools.update_wrapper(self, func, updated=())
+
+    def __reduce__(self):
+        # the cache isn't pickled, a worker process starts with an empty one
+        return (MemoizedFunction, (self.func, self.policy, self.maxsize))
+
+    def __repr__(self):
+        return f"MemoizedFunction({self.func!r}, {self.policy!r}, {self.maxsize})"
+
+    def __call__(self, *args):
+        key = _key(args)
+        if key is None:
+            self.skipped += 1
+            return self.func(*args)
+
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = self.func(*args)
+        self.cache.put(key, value)
+        return value
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "skipped": self.skipped, "size": len(self.cache), "maxsize": self.maxsize, "policy": self.policy}
+
+    def clear(self):
+        """ Empty the cache and reset the counters"""
+        self.cache.clear()
+        self.hits = self.misses = self.skipped = 0
+
+
+def memoized(func, memoize : str = None, memoizeSize : int = 128):
+    return func if memoize is None else MemoizedFunction(func, memoize, memoizeSize)
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import Counter
+
+
+class Metrics:
+    """ Counters a calculator collects while its metrics are enabled, see Calculator.profile"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        # stage -> [calls, seconds]
+        self.stages : dict[str, list] = {}
+        # cache name -> [hits, misses]
+        self.caches : dict[str, list] = {}
+        # (operator kind, symbol) -> calls
+        self.operators : Counter = Counter()
+        # error category -> count
+        self.errors : Counter = Counter()
+
+    def measure(self, stage : str, func, *args):
+        """ Call func(*args), recording its duration under stage and any error it raises"""
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        except Exception as e:
+            self.record_error(e)
+            raise
+        finally:
+            self.record_stage(stage, time.perf_counter() - start)
+
+    def record_stage(self, stage : str, seconds : float):
+        with self.lock:
+            totals = self.stages.setdefault(stage, [0, 0.0])
+            totals[0] += 1
+            totals[1] += seconds
+
+    def record_cache(self, cache : str, hit : bool):
+        with self.lock:
+            self.caches.setdefault(cache, [0, 0])[0 if hit else 1] += 1
+
+    def record_calls(self, program):
+        # a program has no branches, every evaluation calls each of its operators the same number of times
+        with self.lock:
+            self.operators.update(program.callCounts)
+
+    def record_error(self, error : Exception):
+        # errors raised through _throwEquationSyntaxErrorWIndex carry their category
+        with self.lock:
+            self.errors[getattr(error, "category", error.__class__.__name__)] += 1
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            operators = {}
+            for (kind, symbol), calls in self.operators.items():
+                operators.setdefault(kind, {})[symbol] = calls
+
+            return {
+                "stages": {stage: {"calls": calls, "seconds": seconds} for stage, (calls, seconds) in self.stages.items()},
+                "caches": {cache: {"hits": hits, "misses": misses} for cache, (hits, misses) in self.caches.items()},
+                "operators": operators,
+                "errors": dict(self.errors),
+            }
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear()
+            self.caches.clear()
+            self.operators.clear()
+            self.errors.clear()
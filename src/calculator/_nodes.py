@@ -1,72 +1,101 @@
 from typing import Callable
 
+from ._utils import _throwEquationSyntaxErrorWIndex
+
+# nodes are frozen once built, so a parsed tree can be shared between threads and cached expressions
+_set = object.__setattr__
+
 
 class Node:
+    # slots keep nodes small, a large expression has one node per operand and operator
+    __slots__ = ("name",)
+
     def __init__(self, name : str):
-        self.name = name
+        _set(self, "name", name)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Node is immutable!")
+
+    def __setstate__(self, state):
+        # unpickling restores slots through setattr, which nodes refuse
+        _, slots = state
+        for name, value in slots.items():
+            _set(self, name, value)
 
     def getName(self):
         return self.name
-    
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name!r})"
+
 class ValueNode(Node):
-    def getValue(self):
+    __slots__ = ()
+
+    def getValue(self, variables : dict = None):
         pass
 
 class ConstantNode(ValueNode):
+    __slots__ = ("value",)
+
     def __init__(self, value):
         super().__init__(value)
-        self.value = value
-    
-    def getValue(self):
+        _set(self, "value", value)
+
+    def getValue(self, variables : dict = None):
         return self.value
-    
-class UnaryOpNode(ValueNode):
-    def __init__(self, operator : str, operatorFunc : Callable[[float], float], argument_wparen : str, recursive_evaluate_func : Callable[[str], float]):
-        super().__init__(f"{operator}{argument_wparen}")
-        self.operator = operator
-        self.func = operatorFunc
-        self.recursive_evaluate_func = recursive_evaluate_func
-        self.argument = argument_wparen[1:-1]
-
-    def getValue(self):
-        # the recursive evaluate func handles equations inside the argument, eg sin(1+1) or sin(cos(1))
-        return self.func(self.recursive_evaluate_func(self.argument))
-    
+
+
+class VariableNode(ValueNode):
+    __slots__ = ("equation_input", "equationPosition")
+
+    def __init__(self, name : str, equation_input : str, equationPosition : int):
+        super().__init__(name)
+        # kept for error reporting when no value is bound
+        _set(self, "equation_input", equation_input)
+        _set(self, "equationPosition", equationPosition)
+
+    def getValue(self, variables : dict = None):
+        if variables is None or self.name not in variables:
+            _throwEquationSyntaxErrorWIndex(self.equation_input, self.equationPosition, f"No value given for variable: {{{self.name}}} !")
+
+        return variables[self.name]
+
+# operator kinds, tells which operator dict a symbol belongs to
+BINARY = "binary"
+UNARY = "unary"
+SUFFIX = "suffix"
+NEGATION = "negation"
+
+class UnaryOpNode(Node):
+    """ Unary, suffix and negation operators, applied to a single argument subtree"""
+    __slots__ = ("operator", "func", "argument", "kind")
+
+    def __init__(self, operator : str, operatorFunc : Callable[[float], float], argument : Node, kind : str = UNARY):
+        super().__init__(operator)
+        _set(self, "operator", operator)
+        _set(self, "func", operatorFunc)
+        _set(self, "argument", argument)
+        _set(self, "kind", kind)
+
+    def evaluate(self, op):
+        return self.func(op)
+
 
 class BinaryOpNode(Node):
+    __slots__ = ("operator", "func", "leftOperand", "rightOperand")
+
     def __init__(
         self,
         operator : str,
-        operatorPrescendence : int,
         operatorFunc: Callable[[float, float], float],
-        separatorLevel : int,
-        equationPosition : int,
-        leftOperand : ValueNode,
+        leftOperand : Node,
+        rightOperand : Node,
     ):
         super().__init__(operator)
-        self.operatorPrescendence = operatorPrescendence
-        self.separatorLevel = separatorLevel
-        self.func = operatorFunc
-
-        self.equationPosition = equationPosition
-        self.leftOperand = leftOperand
-        
-    def setRightOperand(self, rightOperand : Node):
-        self.rightOperand = rightOperand
+        _set(self, "operator", operator)
+        _set(self, "func", operatorFunc)
+        _set(self, "leftOperand", leftOperand)
+        _set(self, "rightOperand", rightOperand)
 
     def evaluate(self, op1, op2):
-        result = self.func(op1, op2)
-        # print(f"Op: {self.value} {op1=} {op2=} {result=}")
-        return result
-    
-    def hasHigherPrescendence(self, otherOperator : "BinaryOpNode") -> bool:
-        """ Return True if has higher prescedence, false if lower"""
-        if self.separatorLevel == otherOperator.separatorLevel:
-            if self.operatorPrescendence == otherOperator.operatorPrescendence:
-                return self.equationPosition < otherOperator.equationPosition
-            
-            return self.operatorPrescendence > otherOperator.operatorPrescendence
-            
-        
-        return self.separatorLevel > otherOperator.separatorLevel
-    
\ No newline at end of file
+        return self.func(op1, op2)
@@ -0,0 +1,101 @@
+from time import perf_counter
+
+from ._limits import ResourceLimitError
+from ._nodes import Node, ConstantNode, VariableNode, UnaryOpNode, BinaryOpNode, BINARY, UNARY, SUFFIX
+
+
+class Optimizer:
+    """ Folds constant subtrees and hash-conses identical subtrees so each is computed once per evaluation"""
+    def __init__(self, binaryoperators : dict, unaryoperators : dict, suffixoperators : dict):
+        self.operators = {BINARY: binaryoperators, UNARY: unaryoperators, SUFFIX: suffixoperators}
+
+    def isPure(self, kind : str, symbol : str) -> bool:
+        # negation is always pure, operators are pure unless registered otherwise
+        operators = self.operators.get(kind)
+        if operators is None:
+            return True
+        return operators[symbol].get("pure", True)
+
+    @staticmethod
+    def _constantKey(value):
+        # float.hex tells -0.0 and nan apart, anything else is only shared by identity
+        if isinstance(value, float):
+            return ("c", float.hex(value))
+        return ("c", id(value))
+
+    @staticmethod
+    def _check(deadline : float):
+        if perf_counter() > deadline:
+            raise ResourceLimitError("Constant folding exceeded its time budget!", "timeBudget")
+
+    def optimize(self, tree : Node, deadline : float = None) -> Node:
+        """ deadline is a perf_counter time, checked before each fold since folding runs the operators"""
+        # structural key -> canonical node, children are canonical before their parents so their ids identify them
+        table : dict[tuple, Node] = {}
+        # canonical nodes that contain an impure operator, these are never shared
+        impure : set[int] = set()
+        results : list[Node] = []
+
+        def canonical(key, node):
+            existing = table.get(key)
+            if existing is not None:
+                return existing
+            table[key] = node
+            return node
+
+        stack = [(tree, False)]
+        while stack:
+            node, visited = stack.pop()
+
+            if isinstance(node, BinaryOpNode):
+                if not visited:
+                    stack.append((node, True))
+                    stack.append((node.rightOperand, False))
+                    stack.append((node.leftOperand, False))
+                    continue
+
+                right = results.pop()
+                left = results.pop()
+                pure = self.isPure(BINARY, node.operator) and id(left) not in impure and id(right) not in impure
+
+                if pure and isinstance(left, ConstantNode) and isinstance(right, ConstantNode):
+                    if deadline is not None:
+                        self._check(deadline)
+                    value = node.evaluate(left.value, right.value)
+                    results.append(canonical(self._constantKey(value), ConstantNode(value)))
+                elif pure:
+                    results.append(canonical(("b", node.operator, id(left), id(right)), BinaryOpNode(node.operator, node.func, left, right)))
+                else:
+                    newNode = BinaryOpNode(node.operator, node.func, left, right)
+                    impure.add(id(newNode))
+                    table[("impure", id(newNode))] = newNode
+                    results.append(newNode)
+
+            elif isinstance(node, UnaryOpNode):
+                if not visited:
+                    stack.append((node, True))
+                    stack.append((node.argument, False))
+                    continue
+
+                argument = results.pop()
+                pure = self.isPure(node.kind, node.operator) and id(argument) not in impure
+
+                if pure and isinstance(argument, ConstantNode):
+                    if deadline is not None:
+                        self._check(deadline)
+                    value = node.evaluate(argument.value)
+                    results.append(canonical(self._constantKey(value), ConstantNode(value)))
+                elif pure:
+                    results.append(canonical(("u", node.kind, node.operator, id(argument)), UnaryOpNode(node.operator, node.func, argument, node.kind)))
+                else:
+                    newNode = UnaryOpNode(node.operator, node.func, argument, node.kind)
+                    impure.add(id(newNode))
+                    table[("impure", id(newNode))] = newNode
+                    results.append(newNode)
+
+            elif isinstance(node, VariableNode):
+                results.append(canonical(("v", node.name), node))
+            else:
+                results.append(canonical(self._constantKey(node.value), node))
+
+        return results[-1]
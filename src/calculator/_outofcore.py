@@ -0,0 +1,61 @@
+import os
+import time
+
+import numpy as np
+
+
+def _open_input(value):
+    # paths are memory mapped read only, arrays and scalars are used as they are
+    if isinstance(value, (str, os.PathLike)):
+        return np.load(value, mmap_mode="r")
+    if isinstance(value, tuple):
+        # raw binary column, (path, dtype), one value per row
+        path, dtype = value
+        if os.path.getsize(path) == 0:
+            # an empty file can't be mapped
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+    return value
+
+
+def evaluate_file(compiled, inputs : dict, out, chunk_rows : int = 65536) -> dict:
+    """ Evaluate a compiled expression over .npy files too large for memory, chunk_rows rows at a time
+    inputs maps variable names to .npy paths, (path, dtype) pairs for raw binary columns, or arrays/scalars,
+    the result is written to a memory mapped .npy at out
+    only one chunk of every input and of the output is held in memory at once
+    """
+    if chunk_rows < 1:
+        raise ValueError("Chunk rows must be at least 1!")
+
+    arrays = {name: _open_input(value) for name, value in inputs.items()}
+    lengths = {len(value) for value in arrays.values() if np.ndim(value) > 0}
+    if not lengths:
+        raise ValueError("At least one input must be an array!")
+    if len(lengths) > 1:
+        raise ValueError("Input arrays must have the same number of rows!")
+    rows = lengths.pop()
+
+    start_time = time.perf_counter()
+    output = None
+    chunks = 0
+    for start in range(0, rows, chunk_rows):
+        stop = min(start + chunk_rows, rows)
+        chunk = {name: value[start:stop] if np.ndim(value) > 0 else value for name, value in arrays.items()}
+        result = np.asarray(compiled.evaluate(**chunk))
+
+        if output is None:
+            # the output dtype and trailing shape are only known once the first chunk is evaluated
+            output = np.lib.format.open_memmap(out, mode="w+", dtype=result.dtype, shape=(rows, *result.shape[1:]))
+        output[start:stop] = result
+        chunks += 1
+
+    if output is None:
+        # no rows, the empty slices still give the output dtype
+        result = np.asarray(compiled.evaluate(**{name: value[:0] if np.ndim(value) > 0 else value for name, value in arrays.items()}))
+        output = np.lib.format.open_memmap(out, mode="w+", dtype=result.dtype, shape=(0, *result.shape[1:]))
+
+    output.flush()
+    del output
+
+    seconds = time.perf_counter() - start_time
+    return {"rows": rows, "chunks": chunks, "seconds": seconds, "rows_per_second": rows / seconds if seconds > 0 else float("inf")}
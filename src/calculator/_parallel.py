@@ -0,0 +1,121 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from math import prod
+from typing import Callable
+
+import numpy as np
+
+from ._bytecode import Program, LOAD_CONST, LOAD_VAR, CALL_UNARY, CALL_BINARY, STORE_TEMP
+
+# elements per block, a few scratch buffers of 16384 float64 stay within a core's L2 cache
+BLOCK_SIZE = 16384
+
+
+def _run_block(instructions : tuple, bound : list, buffers : list, temps : list, tempBuffers : list):
+    # like Program.run, but ufuncs write into the stack slot's scratch buffer instead of allocating
+    stack = [None] * len(buffers)
+    sp = 0
+
+    for op, arg in instructions:
+        if op == LOAD_CONST:
+            stack[sp] = arg
+            sp += 1
+        elif op == CALL_BINARY:
+            sp -= 1
+            if isinstance(arg, np.ufunc):
+                stack[sp-1] = arg(stack[sp-1], stack[sp], out=buffers[sp-1])
+            else:
+                stack[sp-1] = arg(stack[sp-1], stack[sp])
+        elif op == CALL_UNARY:
+            if isinstance(arg, np.ufunc):
+                stack[sp-1] = arg(stack[sp-1], out=buffers[sp-1])
+            else:
+                stack[sp-1] = arg(stack[sp-1])
+        elif op == LOAD_VAR:
+            stack[sp] = bound[arg]
+            sp += 1
+        elif op == STORE_TEMP:
+            # the slot's buffer becomes the temporary, the temporary's old buffer becomes the slot's scratch
+            temps[arg] = stack[sp-1]
+            if temps[arg] is buffers[sp-1]:
+                buffers[sp-1], tempBuffers[arg] = tempBuffers[arg], buffers[sp-1]
+        else:
+            stack[sp] = temps[arg]
+            sp += 1
+
+    return stack[0]
+
+
+def run_blocked(program : Program, variables : dict, clip : Callable, workers : int = None, block_size : int = BLOCK_SIZE, dtype : np.dtype = None) -> np.ndarray:
+    """ Evaluate a program over large arrays in cache sized blocks of rows, spread over a thread pool
+    every block runs the whole program with preallocated scratch buffers passed to ufuncs as out=
+    the blocks compute the same element-wise results as Program.run, in a floating point dtype (float64 unless given)
+    the buffers only hold results of that dtype when the arrays already have it, other arrays (eg int64, which may promote
+    part way through a program, or float32) go through Program.run per block instead, allocating,
+    and the output takes the dtype of the first block's result
+    """
+    if block_size < 1:
+        raise ValueError("Block size must be at least 1!")
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    bound = program.bind(variables)
+    shape = np.broadcast_shapes(*(np.shape(value) for value in bound))
+    if not shape:
+        return clip(program.run(variables))
+
+    rows = shape[0]
+    rowSize = prod(shape[1:])
+    blockRows = max(1, block_size // max(rowSize, 1))
+    if dtype is None:
+        dtype = np.dtype(np.float64)
+    # writing into buffers of another dtype would cast every intermediate result, so only matching arrays use them
+    allocating = dtype.kind != "f" or any(value.dtype != dtype for value in bound if isinstance(value, np.ndarray))
+
+    # only arguments spanning every row are split, the rest broadcast against each block as they are
+    split = [np.ndim(value) == len(shape) and np.shape(value)[0] == rows and rows > 1 for value in bound]
+    local = threading.local()
+
+    def run_allocating(start):
+        stop = min(start + blockRows, rows)
+        blockBound = [value[start:stop] if isSplit else value for value, isSplit in zip(bound, split)]
+        return start, stop, clip(program.run(dict(zip(program.variables, blockBound))))
+
+    def run(start):
+        if allocating:
+            start, stop, result = run_allocating(start)
+            output[start:stop] = result
+            return
+        if not hasattr(local, "buffers"):
+            local.buffers = [np.empty((blockRows, *shape[1:]), dtype=dtype) for _ in range(program.stackSize)]
+            local.tempBuffers = [np.empty((blockRows, *shape[1:]), dtype=dtype) for _ in range(program.tempSize)]
+        stop = min(start + blockRows, rows)
+
+        # the last block may be shorter, its buffers are views of the full sized ones
+        buffers = [buffer[:stop-start] for buffer in local.buffers]
+        tempBuffers = [buffer[:stop-start] for buffer in local.tempBuffers]
+        blockBound = [value[start:stop] if isSplit else value for value, isSplit in zip(bound, split)]
+
+        result = _run_block(program.instructions, blockBound, buffers, [None] * program.tempSize, tempBuffers)
+        output[start:stop] = clip(result)
+
+    starts = range(0, rows, blockRows)
+    if allocating:
+        _, stop, first = run_allocating(0)
+        output = np.empty(shape, dtype=np.result_type(first))
+        output[:stop] = first
+        starts = starts[1:]
+    else:
+        output = np.empty(shape, dtype=dtype)
+
+    if workers <= 1 or len(starts) <= 1:
+        for start in starts:
+            run(start)
+    else:
+        with ThreadPoolExecutor(workers) as pool:
+            # consume the iterator so a failing block raises here
+            for _ in pool.map(run, starts):
+                pass
+
+    return output
@@ -0,0 +1,89 @@
+import numpy as np
+
+from ._lexer import Token, OPERATOR, SEPARATOR, SUFFIX, NEGATION
+from ._nodes import Node, UnaryOpNode, BinaryOpNode
+from . import _nodes
+
+# marks a pending negation on the operator stack
+_NEGATE = object()
+
+
+class Parser:
+    """ Shunting-yard parser, builds the tree with explicit stacks so input length is not bound by the recursion limit"""
+    def __init__(self, binaryoperators : dict, unaryoperators : dict, suffixoperators : dict, negationChar : str, openSeparator : str):
+        self.binaryoperators = binaryoperators
+        self.unaryoperators = unaryoperators
+        self.suffixoperators = suffixoperators
+        self.negationChar = negationChar
+        self.openSeparator = openSeparator
+
+    def _reduce(self, entry, operands : list[Node]):
+        if entry is _NEGATE:
+            operands[-1] = UnaryOpNode(self.negationChar, np.negative, operands[-1], _nodes.NEGATION)
+        else:
+            right = operands.pop()
+            operands[-1] = BinaryOpNode(entry, self.binaryoperators[entry]["f"], operands[-1], right)
+
+    def parse(self, processed : list) -> Node:
+        """ processed is the output of validate_and_convert_input_string, value nodes mixed with operator/separator tokens"""
+        operands : list[Node] = []
+        # binary operator symbols, _NEGATE, or a tuple for an open separator: (unary operator it belongs to or None,)
+        operators = []
+        pending_unary = None
+
+        for item in processed:
+            if not isinstance(item, Token):
+                operands.append(item)
+                continue
+
+            kind = item.kind
+            symbol = item.text
+
+            if kind == SEPARATOR:
+                if symbol == self.openSeparator:
+                    operators.append((pending_unary,))
+                    pending_unary = None
+                    continue
+
+                # close separator, everything since the matching open separator binds first
+                while not isinstance(operators[-1], tuple):
+                    self._reduce(operators.pop(), operands)
+
+                unary, = operators.pop()
+                if unary is not None:
+                    operands[-1] = UnaryOpNode(unary, self.unaryoperators[unary]["f"], operands[-1])
+
+            elif kind == OPERATOR and symbol in self.unaryoperators:
+                # its argument starts at the next open separator
+                pending_unary = symbol
+
+            elif kind == OPERATOR:
+                precedence = self.binaryoperators[symbol]["p"]
+                rightAssoc = self.binaryoperators[symbol].get("rightAssoc", False)
+
+                while operators:
+                    top = operators[-1]
+                    if isinstance(top, tuple):
+                        # open separator
+                        break
+                    elif top is not _NEGATE:
+                        topPrecedence = self.binaryoperators[top]["p"]
+                        if topPrecedence < precedence or (topPrecedence == precedence and rightAssoc):
+                            break
+
+                    self._reduce(operators.pop(), operands)
+
+                operators.append(symbol)
+
+            elif kind == NEGATION:
+                # negation binds tighter than any binary operator, same as a negative literal: -a^2 == (-a)^2
+                operators.append(_NEGATE)
+
+            elif kind == SUFFIX:
+                # suffix operators bind to the operand right before them
+                operands[-1] = UnaryOpNode(symbol, self.suffixoperators[symbol]["f"], operands[-1], _nodes.SUFFIX)
+
+        while operators:
+            self._reduce(operators.pop(), operands)
+
+        return operands[-1] if operands else None
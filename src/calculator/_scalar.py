@@ -0,0 +1,114 @@
+"""
+Scalar equivalents of numpy ufuncs, used by the scalar execution mode to skip ufunc dispatch on plain floats.
+Edge cases follow numpy (nan/inf instead of exceptions). Each function agrees with its ufunc to within a few ulp,
+since numpy may use its own vectorized implementations, so results match the numpy path within SCALAR_RTOL.
+"""
+import inspect
+import math
+import operator
+
+import numpy as np
+
+SCALAR_RTOL = 1e-12
+
+
+def _divide(a, b):
+    try:
+        return a / b
+    except ZeroDivisionError:
+        if a == 0 or a != a:
+            return math.nan
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+
+def _remainder(a, b):
+    try:
+        return a % b
+    except ZeroDivisionError:
+        return math.nan
+
+
+def _power(a, b):
+    try:
+        return math.pow(a, b)
+    except OverflowError:
+        # negative base with an odd integer exponent keeps its sign
+        return -math.inf if a < 0 and b % 2 == 1 else math.inf
+    except ValueError:
+        if a == 0:
+            # zero to a negative power
+            return -math.inf if math.copysign(1.0, a) < 0 and b % 2 == 1 else math.inf
+        # negative base with a non integer exponent
+        return math.nan
+
+
+def _exp(x):
+    try:
+        return math.exp(x)
+    except OverflowError:
+        return math.inf
+
+
+def _log(x):
+    if x > 0:
+        return math.log(x)
+    if x == 0:
+        return -math.inf
+    return math.nan
+
+
+def _sqrt(x):
+    return math.sqrt(x) if x >= 0 else math.nan
+
+
+def _sin(x):
+    return math.sin(x) if not math.isinf(x) else math.nan
+
+
+def _cos(x):
+    return math.cos(x) if not math.isinf(x) else math.nan
+
+
+def _tan(x):
+    return math.tan(x) if not math.isinf(x) else math.nan
+
+
+def _asin(x):
+    return math.asin(x) if -1 <= x <= 1 else math.nan
+
+
+def _acos(x):
+    return math.acos(x) if -1 <= x <= 1 else math.nan
+
+
+SCALAR_EQUIVALENTS = {
+    np.add: operator.add,
+    np.subtract: operator.sub,
+    np.multiply: operator.mul,
+    np.divide: _divide,
+    np.remainder: _remainder,
+    np.power: _power,
+    np.negative: operator.neg,
+    np.absolute: abs,
+    np.exp: _exp,
+    np.log: _log,
+    np.sqrt: _sqrt,
+    np.sin: _sin,
+    np.cos: _cos,
+    np.tan: _tan,
+    np.arcsin: _asin,
+    np.arccos: _acos,
+    np.arctan: math.atan,
+}
+
+
+def scalar_equivalent(func, scalarFunc = None):
+    """ The user supplied scalar variant, else a known equivalent of a numpy ufunc, else func itself"""
+    if scalarFunc is not None:
+        return scalarFunc
+    try:
+        # memoized or guarded ufuncs (see _memo, _limits) keep their equivalent
+        return SCALAR_EQUIVALENTS.get(inspect.unwrap(func), func)
+    except TypeError:
+        # unhashable callable
+        return func
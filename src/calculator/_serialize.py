@@ -0,0 +1,197 @@
+"""
+Versioned binary format for compiled programs, so they can be cached on disk and loaded without parsing.
+
+layout (little endian, sections aligned to 8 bytes):
+    header      magic, version, dtype, fingerprint of the calculator configuration, section lengths
+    code        int32 opcode, argument pairs, loaded zero-copy from a memory map
+    constants   8 bytes each, float64 or int64 bits depending on their tag
+    tags        one byte per constant: its python/numpy type
+    metadata    utf-8 json: source, (operator kind, symbol) per function, variable names and positions
+
+Operators are stored by symbol and resolved against the loading calculator, whose fingerprint has to match.
+
+A library file holds many programs under names, for loading a whole set of formulas from one memory map:
+    header      magic, version, fingerprint, program count, names length
+    offsets     uint64 offset, length of each program in the file
+    names       utf-8 json list of the program names, in offset order
+    programs    one dump_program output each
+the fingerprint is checked once for the whole library and each program is only decoded when first used.
+"""
+import hashlib
+import json
+import mmap
+import struct
+import sys
+from collections.abc import Mapping
+
+import numpy as np
+
+from ._bytecode import Program
+from ._dtypes import DTYPES
+
+MAGIC = b"CCPROG"
+VERSION = 1
+# magic, version, dtype index, fingerprint, code length, constants, stack size, temp size, metadata bytes
+_HEADER = struct.Struct("<6sHH32sIIIII")
+
+LIBRARY_MAGIC = b"CCLIBR"
+# magic, version, fingerprint, program count, names bytes
+_LIBRARY_HEADER = struct.Struct("<6sH32sII")
+
+# constant type tags
+_FLOAT, _FLOAT64, _FLOAT32, _INT64 = b"d", b"D", b"f", b"q"
+
+
+def _function_name(func) -> str:
+    return f"{getattr(func, '__module__', None) or ''}.{getattr(func, '__qualname__', None) or getattr(func, '__name__', repr(func))}"
+
+
+def fingerprint(calculator) -> bytes:
+    """ sha256 of everything that changes how an expression compiles: operators, precedences, constants, separators, negation"""
+    config = {
+        "binary": {symbol: [op["p"], op.get("rightAssoc", False), op.get("pure", True), _function_name(op["f"])] for symbol, op in calculator.binaryoperators.items()},
+        "unary": {symbol: [op.get("pure", True), _function_name(op["f"])] for symbol, op in calculator.unaryoperators.items()},
+        "suffix": {symbol: [op.get("pure", True), _function_name(op["f"])] for symbol, op in calculator.suffixoperators.items()},
+        "constants": {name: repr(value) for name, value in calculator.constants.items()},
+        "separators": [calculator.openSeparator, calculator.closeSeparator],
+        "negation": calculator.negationChar,
+    }
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).digest()
+
+
+def _pad(length : int) -> int:
+    return -length % 8
+
+
+def dump_program(program : Program, calculator, dtype : np.dtype) -> bytes:
+    tags = bytearray()
+    constants = bytearray()
+    for constant in program.constants:
+        if type(constant) is float:
+            tags += _FLOAT
+        elif isinstance(constant, np.float64):
+            tags += _FLOAT64
+        elif isinstance(constant, np.float32):
+            tags += _FLOAT32
+        elif isinstance(constant, (int, np.integer)) and not isinstance(constant, bool):
+            tags += _INT64
+            constants += struct.pack("<q", int(constant))
+            continue
+        else:
+            raise ValueError(f"Only float and int constants can be serialized: {{{constant!r}}} !")
+        constants += struct.pack("<d", float(constant))
+
+    code = np.asarray(program.code, dtype="<i4").tobytes()
+    metadata = json.dumps({
+        "source": program.source,
+        "functions": program.functionNames,
+        "variables": program.variables,
+        "positions": program.variablePositions,
+    }).encode()
+
+    header = _HEADER.pack(MAGIC, VERSION, DTYPES.index(dtype), calculator._config_fingerprint(), len(program.code),
+                          len(program.constants), program.stackSize, program.tempSize, len(metadata))
+    sections = [header, code, bytes(constants), bytes(tags), metadata]
+    return b"".join(section + b"\0" * _pad(len(section)) for section in sections)
+
+
+def load_program(buffer, calculator, verify : bool = True) -> tuple[Program, np.dtype]:
+    """ Program from dump_program output, buffer can be bytes or a memory map, the code is not copied
+    verify=False skips the fingerprint check, for programs of a library that was checked as a whole
+    """
+    view = memoryview(buffer)
+    if len(view) < _HEADER.size or bytes(view[:len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a serialized calculator program!")
+    magic, version, dtypeIndex, storedFingerprint, codeLength, constantCount, stackSize, tempSize, metadataLength = _HEADER.unpack_from(view)
+    if version != VERSION:
+        raise ValueError(f"Unsupported serialized program version: {{{version}}} !")
+    if verify and storedFingerprint != calculator._config_fingerprint():
+        raise ValueError("Serialized program was compiled by a differently configured calculator!")
+
+    offset = _HEADER.size + _pad(_HEADER.size)
+    code = view[offset:offset + 4*codeLength]
+    # the format is little endian, native int32 views are only zero-copy on matching machines
+    code = code.cast("i") if sys.byteorder == "little" else np.frombuffer(code, dtype="<i4").astype("i4")
+    offset += 4*codeLength + _pad(4*codeLength)
+
+    values = view[offset:offset + 8*constantCount]
+    offset += 8*constantCount
+    tags = bytes(view[offset:offset + constantCount])
+    offset += constantCount + _pad(constantCount)
+    metadata = json.loads(bytes(view[offset:offset + metadataLength]))
+
+    constants = []
+    for i in range(constantCount):
+        tag = tags[i:i+1]
+        if tag == _INT64:
+            constants.append(np.int64(struct.unpack_from("<q", values, 8*i)[0]))
+            continue
+        value = struct.unpack_from("<d", values, 8*i)[0]
+        constants.append(value if tag == _FLOAT else np.float64(value) if tag == _FLOAT64 else np.float32(value))
+
+    functionNames = [tuple(name) for name in metadata["functions"]]
+    functions = [calculator.operator_function(kind, symbol) for kind, symbol in functionNames]
+
+    program = Program(code, constants, functions, functionNames, metadata["variables"], stackSize, metadata["source"],
+                      metadata["positions"], tempSize, calculator._scalar_variant)
+    return program, DTYPES[dtypeIndex]
+
+
+def dump_library(programs : dict[str, bytes], calculator) -> bytes:
+    """ Library of named dump_program outputs, see ProgramLibrary"""
+    names = json.dumps(list(programs)).encode()
+    header = _LIBRARY_HEADER.pack(LIBRARY_MAGIC, VERSION, calculator._config_fingerprint(), len(programs), len(names))
+
+    offset = len(header) + _pad(len(header)) + 16*len(programs) + len(names) + _pad(len(names))
+    offsets = np.empty((len(programs), 2), dtype="<u8")
+    for i, data in enumerate(programs.values()):
+        offsets[i] = offset, len(data)
+        offset += len(data) + _pad(len(data))
+
+    sections = [header, offsets.tobytes(), names, *programs.values()]
+    return b"".join(section + b"\0" * _pad(len(section)) for section in sections)
+
+
+class ProgramLibrary(Mapping):
+    """ Read only mapping of name -> compiled expression over a library file, each program is loaded on first access"""
+    def __init__(self, buffer, calculator):
+        view = memoryview(buffer)
+        if len(view) < _LIBRARY_HEADER.size or bytes(view[:len(LIBRARY_MAGIC)]) != LIBRARY_MAGIC:
+            raise ValueError("Not a serialized calculator library!")
+        magic, version, storedFingerprint, count, namesLength = _LIBRARY_HEADER.unpack_from(view)
+        if version != VERSION:
+            raise ValueError(f"Unsupported serialized library version: {{{version}}} !")
+        if storedFingerprint != calculator._config_fingerprint():
+            raise ValueError("Serialized library was compiled by a differently configured calculator!")
+
+        offset = _LIBRARY_HEADER.size + _pad(_LIBRARY_HEADER.size)
+        self.offsets = np.frombuffer(view, dtype="<u8", count=2*count, offset=offset).reshape(count, 2)
+        offset += 16*count
+        self.names = json.loads(bytes(view[offset:offset + namesLength]))
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.view = view
+        self.calculator = calculator
+        self.loaded = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name : str):
+        compiled = self.loaded.get(name)
+        if compiled is None:
+            offset, length = (int(x) for x in self.offsets[self.index[name]])
+            compiled = self.calculator._load(self.view[offset:offset + length], verify=False)
+            self.loaded[name] = compiled
+        return compiled
+
+
+def map_file(path):
+    """ Read only memory map of a file, closed when the last view of it goes away"""
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
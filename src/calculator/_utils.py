@@ -1,3 +1,33 @@
+import math
+
+
+def _formatEquationError(equation_input : str, index : int, errorDescription : str) -> str:
+    # the caret lines up under the equation once python prefixes "SyntaxError: "
+    return (f"{equation_input} is not a valid equation!\n"+
+            f"{len(SyntaxError.__name__ + ': ') * ' '}{'~'*index}^ {errorDescription}")
+
 def _throwEquationSyntaxErrorWIndex(equation_input : str,  index : int, errorDescription : str = "error here"):
-    raise SyntaxError(f"{equation_input} is not a valid equation!\n"+
-                    f"{len(SyntaxError.__name__ + ": ") * " "}{"~"*index}^ {errorDescription}")
\ No newline at end of file
+    error = SyntaxError(_formatEquationError(equation_input, index, errorDescription))
+    # eg "Missing Operand", "Failed to convert", used to count errors by kind
+    error.category = errorDescription.split(":")[0].rstrip("! ")
+    raise error
+
+def _to_plain(result):
+    # numpy scalars and arrays as json/csv friendly python values
+    return result.tolist() if hasattr(result, "tolist") else result
+
+def _to_json(value):
+    # strict json has no Infinity or NaN, a plain result writes them as the strings float() reads back
+    if isinstance(value, float) and not math.isfinite(value):
+        return "NaN" if math.isnan(value) else ("Infinity" if value > 0 else "-Infinity")
+    if isinstance(value, list):
+        return [_to_json(item) for item in value]
+    return value
+
+def _from_json(value):
+    # results are numbers, so any string is a non-finite one written by _to_json
+    if isinstance(value, str):
+        return float(value)
+    if isinstance(value, list):
+        return [_from_json(item) for item in value]
+    return value
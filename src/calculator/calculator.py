@@ -1,11 +1,32 @@
-from typing import Callable
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator
 
 import numpy as np
 
-from ._trie import Trie
+from ._lexer import Lexer, Token, OPERATOR, SEPARATOR, SUFFIX, NEGATION, strip_spaces
+from ._parser import Parser
+from ._optimizer import Optimizer
+from ._scalar import scalar_equivalent
+from ._autodiff import derivative_rule
+from ._memo import MemoizedFunction, memoized
+from ._limits import Limits, guarded
 from ._utils import _throwEquationSyntaxErrorWIndex
-from ._nodes import Node, ValueNode, ConstantNode, UnaryOpNode, BinaryOpNode
-from ._backedlist import BackedList
+from ._nodes import Node, ValueNode, ConstantNode, VariableNode, UnaryOpNode, BinaryOpNode
+from . import _nodes
+from ._bytecode import Program, compile_program
+from ._batch import iter_calculate_many
+from ._outofcore import evaluate_file
+from ._cache import LRUCache
+from ._flattree import FlatTree
+from ._graph import FormulaGraph
+from ._serialize import fingerprint, load_program, map_file, dump_library, ProgramLibrary
+from ._metrics import Metrics
+from ._diagnostics import Diagnostic
+from . import _diagnostics
+from ._codegen import generate_function
+from ._compiled import CompiledExpression
+from ._dtypes import FLOAT64, INT64, resolve_dtype, materialize, cast_output
+from ._parallel import BLOCK_SIZE
 
 
 
@@ -57,20 +78,31 @@ class CalculatorBuilder:
         self.negationChar = "-"
         self.openSeparator = "("
         self.closeSeparator = ")"
-
-    def addBinaryOperator(self, symbol : str, precedence : int, func : Callable[[float, float], float]):
-        self.binaryoperators[symbol] = {"p": precedence, "f": func}
-
-    def addUnaryOperator(self, symbol : str, func : Callable[[float], float]):
-        self.unaryoperators[symbol] = {"f": func}
+        self.parseCacheSize = 128
+        self.scalarMode = False
+        self.dtype = FLOAT64
+        self.limits = None
+
+    def addBinaryOperator(self, symbol : str, precedence : int, func : Callable[[float, float], float], rightAssociative : bool = False, pure : bool = True, scalarFunc : Callable[[float, float], float] = None, derivative : tuple[Callable, Callable] = None, memoize : str = None, memoizeSize : int = 128, guard : Callable[[float, float], bool] = None):
+        # right associative operators group from the right, eg 2^3^2 == 2^(3^2)
+        # impure operators (eg random numbers) are never constant folded or shared
+        # scalarFunc is used instead of func in scalar mode, numpy ufuncs have known scalar equivalents already
+        # derivative is a pair (a, b) -> df/da, (a, b) -> df/db for gradient, numpy ufuncs have known rules already
+        # memoize "lru" or "lfu" caches up to memoizeSize results by argument value, for expensive pure functions
+        # guard gets the arguments before func, returning False (for any element) raises a ResourceLimitError, eg to refuse huge factorials
+        self.binaryoperators[symbol] = {"p": precedence, "f": memoized(guarded(func, guard, symbol), memoize, memoizeSize), "rightAssoc": rightAssociative, "pure": pure, "scalarF": scalarFunc, "df": derivative, "guard": guard}
+
+    def addUnaryOperator(self, symbol : str, func : Callable[[float], float], pure : bool = True, scalarFunc : Callable[[float], float] = None, derivative : Callable[[float], float] = None, memoize : str = None, memoizeSize : int = 128, guard : Callable[[float], bool] = None):
+        # derivative is x -> f'(x)
+        self.unaryoperators[symbol] = {"f": memoized(guarded(func, guard, symbol), memoize, memoizeSize), "pure": pure, "scalarF": scalarFunc, "df": derivative, "guard": guard}
 
     def addConstant(self, name : str, value : float):
         self.constants[name] = value
 
-    def addSuffixOperator(self, symbol : str, func : Callable[[float], float]):
+    def addSuffixOperator(self, symbol : str, func : Callable[[float], float], pure : bool = True, scalarFunc : Callable[[float], float] = None, derivative : Callable[[float], float] = None, memoize : str = None, memoizeSize : int = 128, guard : Callable[[float], bool] = None):
         if len(symbol) != 1:
             raise ValueError("Suffix operator symbol must be a single character!")
-        self.suffixoperators[symbol] = {"f": func}
+        self.suffixoperators[symbol] = {"f": memoized(guarded(func, guard, symbol), memoize, memoizeSize), "pure": pure, "scalarF": scalarFunc, "df": derivative, "guard": guard}
 
     def setNegationChar(self, symbol : str):
         if len(symbol) != 1:
@@ -83,6 +115,26 @@ class CalculatorBuilder:
         self.openSeparator = openSep
         self.closeSeparator = closeSep
 
+    def setParseCacheSize(self, size : int):
+        # 0 disables the parse cache
+        if size < 0:
+            raise ValueError("Parse cache size must be non-negative!")
+        self.parseCacheSize = size
+
+    def setScalarMode(self, enabled : bool):
+        # evaluate plain float inputs with math/operator functions instead of numpy ufuncs
+        # arrays still take the numpy path, results agree within calculator.SCALAR_RTOL
+        self.scalarMode = enabled
+
+    def setDtype(self, dtype):
+        # float32, float64 or int64, see calculator._dtypes for the promotion rules
+        self.dtype = resolve_dtype(dtype)
+
+    def setLimits(self, maxInputLength : int = None, maxTokens : int = None, maxDepth : int = None, maxNodes : int = None, maxSteps : int = None, timeBudget : float = None):
+        # bounds for untrusted input, going over one raises a ResourceLimitError, None means unlimited
+        # maxSteps is instructions times array elements per evaluation, timeBudget is seconds per evaluation
+        self.limits = Limits(maxInputLength, maxTokens, maxDepth, maxNodes, maxSteps, timeBudget)
+
     def build(self) -> "Calculator":
         if len(self.binaryoperators) == 0:
             raise ValueError("Must have at least one binary operator!")
@@ -93,7 +145,11 @@ class CalculatorBuilder:
                           suffixoperators=self.suffixoperators,
                           negationChar=self.negationChar,
                           openSeparator=self.openSeparator,
-                          closeSeparator=self.closeSeparator)
+                          closeSeparator=self.closeSeparator,
+                          parseCacheSize=self.parseCacheSize,
+                          scalarMode=self.scalarMode,
+                          dtype=self.dtype,
+                          limits=self.limits)
 
 class Calculator:
     def __init__(self, 
@@ -103,7 +159,11 @@ class Calculator:
         suffixoperators : dict, 
         negationChar : str, 
         openSeparator : str, 
-        closeSeparator : str):
+        closeSeparator : str,
+        parseCacheSize : int = 128,
+        scalarMode : bool = False,
+        dtype = FLOAT64,
+        limits : Limits = None):
         self.binaryoperators = binaryoperators
         self.unaryoperators = unaryoperators
         self.constants = constants
@@ -113,303 +173,542 @@ class Calculator:
         self.openSeparator = openSeparator
         self.closeSeparator = closeSeparator
         self.separators = {self.openSeparator, self.closeSeparator}
-
-        self.operatorTrie = Trie()
-
-        for op in self.binaryoperators.keys():
-            self.operatorTrie.put(op)
-
-        for op in self.unaryoperators.keys():
-            self.operatorTrie.put(op)
-
-    def tokenize_input_string(self, input_str : str) -> list[str]:
-        input_str = input_str.replace(" ", "")
-        backedList = BackedList(input_str)
-        lastTokenOperator = False
-        operatorbuffer = None
-
-        input_len = len(input_str)
-        i = 0
-
-        while i < input_len:
-            c = input_str[i]
-
-            # check match against operators
-            operatorstr = operatorbuffer + c if operatorbuffer is not None else c
-            opmatch = self.operatorTrie.isIn(operatorstr)
-
-            if opmatch == 1:
-                # partial match
-                operatorbuffer = operatorstr
-                i+=1
-                continue
-            elif opmatch == 2:
-                # full match
-                if operatorstr in self.unaryoperators.keys():
-                    # all unary ops must be wrapped in two separator
-                    # op(args)
-                    
-                    if i > input_len-3:
-                        # not enough space for args
-                        _throwEquationSyntaxErrorWIndex(input_str, i, "Missing Operator separators!")
-
-                    starti = i
-                    i += 1
-                    if input_str[i] != self.openSeparator:
-                        # should immdiately start with open sep
-                        _throwEquationSyntaxErrorWIndex(input_str, i, "Invalid operator separators!")
-
-                    endsep = None
-
-                    i += 1
-                    # find next close separator
-                    separatorLvl = 1
-                    while i < input_len and separatorLvl != 0:
-                        next_c = input_str[i]
-                        if next_c == self.openSeparator:
-                            separatorLvl+=1
-                        elif next_c == self.closeSeparator:
-                            endsep = i
-                            separatorLvl-=1
-
-                        i += 1
-
-                    if separatorLvl != 0:
-                        _throwEquationSyntaxErrorWIndex(input_str, i, "Invalid operator separators!")
-
-                    if endsep is None:
-                        # not found
-                        _throwEquationSyntaxErrorWIndex(input_str, i, "No closing separator!")
-
-
-                    # slice from [op(args)]
-                    startslice = starti-len(operatorstr)+1
-                    endslice = endsep+1
-
-                    backedList.addChunk(startslice, starti+1)
-                    backedList.addChunk(starti+1, endslice)
-                    i = endslice
-                    lastTokenOperator = False
-
-                elif operatorstr in self.binaryoperators.keys():
-                    # this handles special case of negation, where you might have possibly defined a character for negation, and it might be the same as a binary operator
-                    is_special_subtr = operatorstr == self.negationChar and (i == 0 or lastTokenOperator)
-
-                    if not is_special_subtr:
-                        backedList.addChunk(i-len(operatorstr)+1, i+1)
-                    
-                    i += 1
-
-                lastTokenOperator = True
-                operatorbuffer = None # reset
-                continue
-
-            elif opmatch == 0:
-                # no match
-                # this means if we had items in the buffer, the addition of the new char c caused it to stop matching
-                # try c as its own
-                if operatorbuffer is not None:
-                    operatorbuffer = None
-                    continue
-                # else proceed as normal
-
-            # separators are not tokens, just for adjusting order of operations
-            if c in self.separators:
-                backedList.addChunkI(i)
-            else:
-                lastTokenOperator = False
-                # normal char, part of a number/constant
-
-            i += 1
-        
-        return backedList.getAsList()        
-            
-
-    def validate_and_convert_input_string(self, tokenized_str : list[str], raw_input_str):
-        idx_offset = 0
-        last_binary_op = -1
-
-        separator_lvl = 0
-
-
-        i = 0
-        while i < len(tokenized_str):
-            value = tokenized_str[i]
-            idx_offset += len(value)
-
-            is_separator = value in self.separators
-            is_binary = value in self.binaryoperators.keys()
-            is_unary = value in self.unaryoperators.keys()
-            is_expected_numeric = not any([is_separator, is_binary, is_unary])
-
-            if is_separator:
+        self.scalarMode = scalarMode
+        self.dtype = resolve_dtype(dtype)
+        # None unless set, see CalculatorBuilder.setLimits
+        self.limits = limits
+
+        # longest match tables are built once here
+        self.lexer = Lexer(operators=[*self.binaryoperators.keys(), *self.unaryoperators.keys()],
+                           suffixoperators=self.suffixoperators.keys(),
+                           negationChar=self.negationChar,
+                           openSeparator=self.openSeparator,
+                           closeSeparator=self.closeSeparator)
+        self.parser = Parser(binaryoperators=self.binaryoperators,
+                             unaryoperators=self.unaryoperators,
+                             suffixoperators=self.suffixoperators,
+                             negationChar=self.negationChar,
+                             openSeparator=self.openSeparator)
+        self.optimizer = Optimizer(binaryoperators=self.binaryoperators,
+                                   unaryoperators=self.unaryoperators,
+                                   suffixoperators=self.suffixoperators)
+
+        # LRU caches of (stripped input, dtype) -> CompiledExpression / stripped input -> generated function
+        self.parseCacheSize = parseCacheSize
+        self.parseCache = LRUCache(parseCacheSize)
+        self.functionCache = LRUCache(parseCacheSize)
+
+        # None unless enabled, checking it is all instrumentation costs when off
+        self.metrics : Metrics = None
+        # hook(event, value) is called with "tokens", "processed", "tree", "program" and "result" while compiling
+        self.hooks : list[Callable] = []
+        # hash of the configuration, see fingerprint
+        self.configFingerprint : bytes = None
+
+    def __reduce__(self):
+        # pickled as its configuration, a worker process rebuilds the tables and starts with empty caches
+        # operator functions must be picklable, ie numpy ufuncs or module level functions but not lambdas
+        return (Calculator, (self.binaryoperators, self.unaryoperators, self.constants, self.suffixoperators,
+                             self.negationChar, self.openSeparator, self.closeSeparator, self.parseCacheSize, self.scalarMode, self.dtype, self.limits))
+
+    def tokenize_input_string(self, input_str : str) -> list[Token]:
+        return self.lexer.tokenize(strip_spaces(input_str))
+
+    def validate_and_convert_input_string(self, tokens : list[Token], raw_input_str, dtype = None) -> list:
+        """ Checks the token order and converts numbers/constants/variables into value nodes, the rest stays as tokens for to_tree"""
+        return self._check_tokens(tokens, raw_input_str, dtype, None)
+
+    def _check_tokens(self, tokens : list[Token], raw_input_str, dtype, diagnostics : list) -> list:
+        # without diagnostics the first error raises and the tokens are converted,
+        # with them every error is recorded, the check carries on as if the token was fine and nothing is converted
+        converting = diagnostics is None
+        processed = []
+
+        def error(offset, token, code, description):
+            if converting:
+                _throwEquationSyntaxErrorWIndex(raw_input_str, offset, description)
+            diagnostics.append(Diagnostic(code, offset, token.start, token.end, raw_input_str, description))
+
+        # one entry per open separator, True if it wraps unary arguments
+        separator_stack = []
+        # an operand is expected at the start, after any operator and at the start of separators
+        expect_operand = True
+        last_binary_op = False
+
+        for i, token in enumerate(tokens):
+            value = token.text
+            kind = token.kind
+
+            if kind == SEPARATOR:
                 if value == self.openSeparator:
-                    separator_lvl += 1
-                else:
-                    separator_lvl -= 1
-
-                if separator_lvl < 0:
-                    _throwEquationSyntaxErrorWIndex(raw_input_str, idx_offset-1, "Invalid Separators!!")
-
+                    separator_stack.append(i > 0 and tokens[i-1].kind == OPERATOR and tokens[i-1].text in self.unaryoperators)
+                    processed.append(token)
+                    continue
 
-            elif is_binary:
-                if last_binary_op == i-1:
-                    _throwEquationSyntaxErrorWIndex(raw_input_str, idx_offset-1, "Multiple Binary Operators in a Row!")
+                if not separator_stack:
+                    error(token.start, token, _diagnostics.INVALID_SEPARATORS, "Invalid Separators!!")
+                    continue
 
-                if i == 0 or i == len(tokenized_str)-1:
-                    _throwEquationSyntaxErrorWIndex(raw_input_str, idx_offset-1, "Invalid Binary Operator!")
+                is_unary_args = separator_stack.pop()
+                if tokens[i-1].text == self.openSeparator:
+                    if is_unary_args:
+                        error(token.start, token, _diagnostics.MISSING_OPERATOR_ARGUMENTS, "Missing Operator arguments!")
+                    else:
+                        error(token.start, token, _diagnostics.EMPTY_SEPARATORS, "Empty Separators!")
+                elif expect_operand:
+                    error(token.start, token, _diagnostics.MISSING_OPERAND, "Missing Operand!")
+
+                processed.append(token)
+                # the separated group is a value itself
+                expect_operand = False
+
+            elif kind == OPERATOR and value in self.unaryoperators:
+                if not expect_operand:
+                    error(token.start, token, _diagnostics.MISSING_BINARY_OPERATOR, "Missing Binary Operator!")
+
+                # all unary ops must be followed by their arguments wrapped in separators: op(args)
+                if i == len(tokens)-1:
+                    # not enough space for args
+                    error(token.end-1, token, _diagnostics.MISSING_OPERATOR_SEPARATORS, "Missing Operator separators!")
+                elif tokens[i+1].text != self.openSeparator:
+                    # should immdiately start with open sep
+                    error(token.end, token, _diagnostics.INVALID_OPERATOR_SEPARATORS, "Invalid operator separators!")
+
+                processed.append(token)
+                expect_operand = True
+                last_binary_op = False
+
+            elif kind == OPERATOR:
+                if expect_operand:
+                    if last_binary_op:
+                        error(token.start, token, _diagnostics.MULTIPLE_BINARY_OPERATORS, "Multiple Binary Operators in a Row!")
+                    else:
+                        error(token.start, token, _diagnostics.INVALID_BINARY_OPERATOR, "Invalid Binary Operator!")
+                # needs a right operand
+                elif i == len(tokens)-1 or tokens[i+1].text == self.closeSeparator:
+                    error(token.start, token, _diagnostics.INVALID_BINARY_OPERATOR, "Invalid Binary Operator!")
                 
+                processed.append(token)
+                expect_operand = True
+                last_binary_op = True
 
-                last_binary_op = i
-            elif is_expected_numeric:
-                # check if constant
-                if value in self.constants.keys():
-                    tokenized_str[i] = ConstantNode(self.constants[value])
-                # check if some value with a suffix operator: value[suffixoperator]
-                elif len(value) > 1 and value[-1:] in self.suffixoperators.keys():
-                    func = self.suffixoperators[value[-1:]]
-
-                    #  try conversion to float before applying suffix operator
-                    try:
-                        value_f = float(value[:-1])
-                    except ValueError:
-                        _throwEquationSyntaxErrorWIndex(raw_input_str , idx_offset-2, f"Failed to convert: {{{value[:-1]}}} !")
-                    
-                    tokenized_str[i] = ConstantNode(func(value_f))
-                else:
-                    #  try conversion to float
-                    try:
-                        tokenized_str[i] = ConstantNode(float(value))
-                    except ValueError:
-                        _throwEquationSyntaxErrorWIndex(raw_input_str , idx_offset-1, f"Failed to convert: {{{value}}} !")
-            elif is_unary:
-                # ops args, are next value
-                tokenized_str[i] = UnaryOpNode(value, self.unaryoperators[value]["f"], tokenized_str[i+1], self.calculate)
-                # remove the next token, as we are using it immediately
-                del tokenized_str[i+1]
-            
-            i += 1
+            elif kind == NEGATION:
+                # applies to the next operand, eg -(1+2) or -sin(1)
+                processed.append(token)
+                last_binary_op = False
 
-        if separator_lvl != 0:
-            _throwEquationSyntaxErrorWIndex(raw_input_str, idx_offset-1, "Invalid Separator Level!")
+            elif kind == SUFFIX:
+                # suffix operators apply to the operand right before them: value[suffixoperator]
+                if expect_operand:
+                    error(token.start, token, _diagnostics.INVALID_SUFFIX, f"Failed to apply suffix operator: {{{value}}} !")
 
-        return tokenized_str    
-        
-    def to_tree(self, processed_input : list):
-        separatorLevel = 0
-        root : Node = None
-        lastBinaryOp : BinaryOpNode = None
-        op1 : ValueNode = None
-
-        for i in range(len(processed_input)):
-            val = processed_input[i]
-            if val in self.separators:
-                if val == self.openSeparator:
-                    separatorLevel+=1
-                else:
-                    separatorLevel-=1
-                continue
-
-            if type(val) == str and val in self.binaryoperators.keys():
-                # op1 is guaranteed to be updated before we see an operator
-                operator = BinaryOpNode(val, self.binaryoperators[val]["p"], self.binaryoperators[val]["f"], separatorLevel, i, op1)
-
-                if lastBinaryOp is not None:
-                    lastBinaryOp.setRightOperand(operator)
-                else:
-                    root = operator
+                processed.append(token)
 
-                lastBinaryOp = operator
-            
-            elif issubclass(val.__class__, ValueNode):
-                op1 = val
-                if root is None:
-                    root = val
-
-        # set final operand
-        if lastBinaryOp is not None:
-            for val in processed_input[::-1]:
-                if issubclass(val.__class__, ValueNode):
-                    lastBinaryOp.setRightOperand(val)
-                    break
-
-        return root
-    
+            else:
+                # number, constant or variable
+                if not expect_operand:
+                    error(token.start, token, _diagnostics.MISSING_BINARY_OPERATOR, "Missing Binary Operator!")
+
+                if converting:
+                    processed.append(self._convert_value(value, raw_input_str, token.end-1, dtype))
+                elif not self._convertible(value):
+                    error(token.end-1, token, _diagnostics.INVALID_VALUE, f"Failed to convert: {{{value}}} !")
+                expect_operand = False
+                last_binary_op = False
+
+        end = Token(SEPARATOR, "", len(raw_input_str)-1, len(raw_input_str))
+        if separator_stack:
+            error(len(raw_input_str)-1, end, _diagnostics.INVALID_SEPARATOR_LEVEL, "Invalid Separator Level!")
+        if expect_operand:
+            error(len(raw_input_str)-1, end, _diagnostics.MISSING_OPERAND, "Missing Operand!")
+
+        return processed
+
+    def _convertible(self, value : str) -> bool:
+        # whether _convert_value would succeed, without building a node
+        if value in self.constants or value.isidentifier():
+            return True
+        try:
+            float(value)
+            return True
+        except ValueError:
+            pass
+        negated = value[1:]
+        return value[:1] == self.negationChar and (negated in self.constants or negated.isidentifier())
+
+    def validate(self, raw_input : str) -> list[Diagnostic]:
+        """ Every syntax problem in an expression, without raising, an empty list means calculate won't raise a SyntaxError
+        the first diagnostic's message is the one calculate would raise
+        """
+        stripped = strip_spaces(raw_input)
+        if not stripped.replace(self.openSeparator, "").replace(self.closeSeparator, ""):
+            return [Diagnostic(_diagnostics.EMPTY_EXPRESSION, 0, 0, len(raw_input), raw_input, "Please enter a valid non-empty expression!", stripped, 0)]
+
+        diagnostics = []
+        self._check_tokens(self.lexer.tokenize(stripped), stripped, None, diagnostics)
+        return _diagnostics.locate(diagnostics, raw_input, stripped) if diagnostics else diagnostics
+
+    def validate_many(self, raw_inputs : Iterable[str]) -> list[list[Diagnostic]]:
+        return [self.validate(raw_input) for raw_input in raw_inputs]
+
+    def _convert_value(self, value : str, raw_input_str : str, position : int, dtype = None) -> ValueNode:
+        dtype = self.dtype if dtype is None else dtype
+        # check if constant
+        if value in self.constants:
+            return ConstantNode(materialize(self.constants[value], dtype))
+
+        # integral literals are parsed exactly, float() rounds past 2**53
+        if dtype == INT64:
+            try:
+                return ConstantNode(materialize(int(value), dtype))
+            except ValueError:
+                pass
+
+        #  try conversion to float
+        try:
+            return ConstantNode(materialize(float(value), dtype))
+        except ValueError:
+            pass
+
+        if value.isidentifier():
+            # free variable, bound when evaluating
+            return VariableNode(value, raw_input_str, position)
+        
+        # negated constant or variable, eg -pi or -a
+        negated = value[1:]
+        if value[:1] == self.negationChar and negated in self.constants:
+            return ConstantNode(materialize(-self.constants[negated], dtype))
+        if value[:1] == self.negationChar and negated.isidentifier():
+            return UnaryOpNode(self.negationChar, np.negative, VariableNode(negated, raw_input_str, position), _nodes.NEGATION)
+
+        _throwEquationSyntaxErrorWIndex(raw_input_str, position, f"Failed to convert: {{{value}}} !")
+        
+    def to_tree(self, processed_input : list) -> Node:
+        return self.parser.parse(processed_input)
     
-    def printroot(self, node : Node):
-        self._printroot(node)
+    def optimize(self, tree : Node, deadline : float = None) -> Node:
+        """ Fold constant subtrees and share identical subtrees, returns a new tree
+        folding stops with a ResourceLimitError once the perf_counter time deadline passes
+        """
+        return self.optimizer.optimize(tree, deadline)
+
+    def to_program(self, tree : Node, input_str : str = "") -> Program:
+        """ Lower the tree into a flat postfix program for the stack machine evaluator"""
+        return compile_program(tree, input_str, self._scalar_variant)
+
+    def flatten(self, tree : Node, input_str : str = "") -> FlatTree:
+        """ Struct of arrays copy of a tree, typed buffers for the node opcodes, child indices and constants"""
+        return FlatTree.from_tree(tree, input_str)
+
+    def operator_function(self, kind : str, symbol : str) -> Callable:
+        """ The function registered for an operator, by kind (see _nodes) and symbol"""
+        if kind == _nodes.NEGATION:
+            return np.negative
+        operators = {_nodes.BINARY: self.binaryoperators, _nodes.UNARY: self.unaryoperators, _nodes.SUFFIX: self.suffixoperators}[kind]
+        if symbol not in operators:
+            raise ValueError(f"Unknown {kind} operator: {{{symbol}}} !")
+        return operators[symbol]["f"]
+
+    def fingerprint(self) -> str:
+        """ Hash of the configuration serialized programs are tied to"""
+        return self._config_fingerprint().hex()
+
+    def _config_fingerprint(self) -> bytes:
+        # the configuration is fixed once built, so it is hashed once instead of on every load
+        if self.configFingerprint is None:
+            self.configFingerprint = fingerprint(self)
+        return self.configFingerprint
+
+    def load_bytes(self, buffer) -> CompiledExpression:
+        """ A compiled expression from CompiledExpression.to_bytes, rejected if this calculator is configured differently"""
+        return self._load(buffer)
+
+    def _load(self, buffer, verify : bool = True) -> CompiledExpression:
+        program, dtype = load_program(buffer, self, verify)
+        # the tree is rebuilt from the program only if asked for
+        return CompiledExpression(self, program.source, None, program, dtype)
+
+    def load(self, path) -> CompiledExpression:
+        """ Load a compiled expression saved with CompiledExpression.save, the file is memory mapped"""
+        return self.load_bytes(map_file(path))
+
+    def save_library(self, path, expressions : dict):
+        """ Save named expressions (strings or compiled expressions) to one library file, see load_library"""
+        programs = {name: (expression if isinstance(expression, CompiledExpression) else self.compile(expression)).to_bytes()
+                    for name, expression in expressions.items()}
+        with open(path, "wb") as f:
+            f.write(dump_library(programs, self))
+
+    def load_library(self, path) -> ProgramLibrary:
+        """ Memory map a library file as a read only mapping of name -> compiled expression, each loaded on first access"""
+        return ProgramLibrary(map_file(path), self)
+
+    def _scalar_variant(self, kind : str, symbol : str, func : Callable) -> Callable:
+        operators = {_nodes.BINARY: self.binaryoperators, _nodes.UNARY: self.unaryoperators, _nodes.SUFFIX: self.suffixoperators}.get(kind)
+        scalarFunc = operators[symbol].get("scalarF") if operators is not None else None
+        variant = scalar_equivalent(func, scalarFunc)
+        guard = operators[symbol].get("guard") if operators is not None else None
+        if guard is not None and variant is not func:
+            # a known equivalent of the unguarded function, or the user's scalarFunc, is guarded the same way
+            variant = guarded(variant, guard, symbol)
+        return variant
+
+    def _derivative_rule(self, kind : str, symbol : str, func : Callable):
+        operators = {_nodes.BINARY: self.binaryoperators, _nodes.UNARY: self.unaryoperators, _nodes.SUFFIX: self.suffixoperators}.get(kind)
+        derivative = operators[symbol].get("df") if operators is not None else None
+        return derivative_rule(func, derivative)
+
+    def gradient(self, raw_input : str, wrt, /, **variables) -> tuple:
+        """ Value and partial derivatives in one forward pass, eg gradient("a*sin(b)", ["a", "b"], a=2.0, b=arr)
+        returns (value, {"a": d/da, "b": d/db})
+        """
+        return self.compile(raw_input).gradient(wrt, **variables)
+
+    def printprogram(self, program : Program):
+        print(program.disassemble())
         print("") # for newline
 
-    def _printroot(self, node : Node, depth = 0):
-        print(f"{" " * (depth+2)}{node.getName()}", end="")
-
-        if isinstance(node, BinaryOpNode):
-            if isinstance(node.rightOperand, BinaryOpNode):
-                print(f" P: {node.hasHigherPrescendence(node.rightOperand)}")
-            else:
-                print("")
-
-            self._printroot(node.leftOperand, depth+1)
-            self._printroot(node.rightOperand, depth+1)
-
-    def collapse(self, node : BinaryOpNode) -> ConstantNode:
-        if isinstance(node, BinaryOpNode):
-            if isinstance(node.rightOperand, BinaryOpNode):
-                nextOperator = node.rightOperand
-                if node.hasHigherPrescendence(nextOperator):
-                    # can collapse ourselves ("stealing the right nodes leftoperand")
-                    NewNode = ConstantNode(node.evaluate(node.leftOperand.getValue(), nextOperator.leftOperand.getValue()))
-                    nextOperator.leftOperand = NewNode
+    def printroot(self, node : Node):
+        # iterative, trees of long expressions can be deeper than the recursion limit
+        stack = [(node, 0)]
+        while stack:
+            current, depth = stack.pop()
+            print(f"{' ' * (depth+2)}{current.getName()}")
+
+            if isinstance(current, BinaryOpNode):
+                stack.append((current.rightOperand, depth+1))
+                stack.append((current.leftOperand, depth+1))
+            elif isinstance(current, UnaryOpNode):
+                stack.append((current.argument, depth+1))
+        print("") # for newline
 
-                    return self.collapse(node.rightOperand)
+    def collapse(self, node : Node, variables : dict = None) -> ConstantNode:
+        # iterative post-order walk, the tree is never modified
+        values = []
+        stack = [(node, False)]
+        while stack:
+            current, visited = stack.pop()
+
+            if isinstance(current, BinaryOpNode):
+                if visited:
+                    right = values.pop()
+                    values[-1] = current.evaluate(values[-1], right)
                 else:
-                    # need to collapse bottom first
-                    node.rightOperand = self.collapse(node.rightOperand)
+                    stack.append((current, True))
+                    stack.append((current.rightOperand, False))
+                    stack.append((current.leftOperand, False))
+            elif isinstance(current, UnaryOpNode):
+                if visited:
+                    values[-1] = current.evaluate(values[-1])
+                else:
+                    stack.append((current, True))
+                    stack.append((current.argument, False))
+            else:
+                values.append(current.getValue(variables))
 
-            # finally collapse
-            return ConstantNode(node.evaluate(node.leftOperand.getValue(), node.rightOperand.getValue()))
-        
-        if isinstance(node, UnaryOpNode):
-            return ConstantNode(node.getValue())
+        return ConstantNode(values[-1])
         
-        if isinstance(node, ConstantNode):
-            return node
-        
-    def clip_output(self, output : float):
-        if np.isclose(output, 0):
-            return 0
-        if np.isclose(output, np.inf):
-            return np.inf
+    def clip_output(self, output):
+        if isinstance(output, (float, int)):
+            # same as the np.isclose checks below with their default tolerances, without the ufunc overhead
+            if -1e-8 <= output <= 1e-8:
+                return 0
+            if output == np.inf:
+                return np.inf
+            
+            return output
+
+        if np.ndim(output) == 0:
+            if np.isclose(output, 0):
+                return 0
+            if np.isclose(output, np.inf):
+                return np.inf
+            
+            return output
         
-        return output
+        if output.dtype.kind in "iub":
+            # integers are exact, clipping would turn them into floats
+            return output
+
+        # element-wise for arrays, isclose(x, inf) only holds where x is already inf so only zeros need clipping
+        return np.where(np.isclose(output, 0), 0.0, output)
 
     
-    def evaluate_cleaned(self, input_str, debug: bool = False) -> float:
-        tokens = self.tokenize_input_string(input_str)
-        if debug:
-            print(f"{tokens=}")
-        processed = self.validate_and_convert_input_string(tokens, input_str)
-        if debug:
-            print(f"{processed=}")
-        tree = self.to_tree(processed)
-        if debug:
-            self.printroot(tree)
-        result = self.clip_output(self.collapse(tree).getValue())
-        if debug:
-            print(f"{result=}")
+    def enable_metrics(self) -> Metrics:
+        """ Start collecting stage durations, cache hits/misses, operator calls and errors, see Metrics.snapshot"""
+        if self.metrics is None:
+            self.metrics = Metrics()
+        return self.metrics
+
+    def disable_metrics(self):
+        self.metrics = None
+
+    @contextmanager
+    def profile(self):
+        """ with calc.profile() as metrics: ... collects into fresh metrics for the block only"""
+        previous = self.metrics
+        self.metrics = Metrics()
+        try:
+            yield self.metrics
+        finally:
+            self.metrics = previous
+
+    def add_hook(self, hook : Callable):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook : Callable):
+        self.hooks.remove(hook)
+
+    def _print_hook(self, event : str, value):
+        # what debug=True prints
+        if event == "tree":
+            self.printroot(value)
+        elif event == "program":
+            self.printprogram(value)
+        else:
+            print(f"{event}={value!r}")
+
+    def _stage(self, name : str, func : Callable, *args):
+        if self.metrics is None:
+            return func(*args)
+        return self.metrics.measure(name, func, *args)
+
+    def compile_cleaned(self, input_str, debug: bool = False, dtype = None) -> CompiledExpression:
+        dtype = self.dtype if dtype is None else resolve_dtype(dtype)
+        hooks = [*self.hooks, self._print_hook] if debug else self.hooks
+
+        tokens = self._stage("tokenize", self.tokenize_input_string, input_str)
+        if self.limits is not None:
+            self._stage("limits", self.limits.check_tokens, tokens, self.openSeparator, self.closeSeparator)
+        for hook in hooks:
+            hook("tokens", tokens)
+        processed = self._stage("validate", self.validate_and_convert_input_string, tokens, input_str, dtype)
+        for hook in hooks:
+            hook("processed", processed)
+        tree = self._stage("to_tree", self.to_tree, processed)
+        if self.limits is not None:
+            # before optimizing, constant folding runs the operators
+            self._stage("limits", self.limits.check_nodes, tree)
+        # folding runs the operators, so it gets a time budget of its own
+        tree = self._stage("optimize", self.optimize, tree, self.limits.deadline() if self.limits is not None else None)
+        for hook in hooks:
+            hook("tree", tree)
+        program = self._stage("to_program", self.to_program, tree, input_str)
+        for hook in hooks:
+            hook("program", program)
+
+        return CompiledExpression(self, input_str, tree, program, dtype)
+
+    def compile_cached(self, input_str, dtype = None) -> CompiledExpression:
+        dtype = self.dtype if dtype is None else resolve_dtype(dtype)
+        compiled = self.parseCache.get((input_str, dtype))
+        if self.metrics is not None:
+            self.metrics.record_cache("parse", compiled is not None)
+        if compiled is None:
+            compiled = self.compile_cleaned(input_str, dtype=dtype)
+            self.parseCache.put((input_str, dtype), compiled)
+
+        return compiled
+    
+    def evaluate_cleaned(self, input_str, debug: bool = False, dtype = None) -> float:
+        compiled = self.compile_cleaned(input_str, debug=debug, dtype=dtype)
+        result = compiled.evaluate()
+        for hook in ([*self.hooks, self._print_hook] if debug else self.hooks):
+            hook("result", result)
 
         return result
 
-    def calculate(self, raw_input : str, debug: bool = False):
-        stripped = raw_input.replace(" ", "")
+    def strip_input(self, raw_input : str) -> str:
+        if self.limits is not None:
+            self._stage("limits", self.limits.check_input, raw_input)
+        # spaces are dropped except between names, eg "one plus two"
+        stripped = strip_spaces(raw_input)
         
         # remove open/close separators, if nothing is left then error (no actual expression)
         replaced = stripped.replace(self.openSeparator, "").replace(self.closeSeparator, "")
 
         # no actual expression
         if not replaced:
-            raise ValueError("Please enter a valid non-empty expression!")
-        else:
-            # stripped is now guaranteed to have some actual expression
-            return self.evaluate_cleaned(stripped, debug=debug)
+            error = ValueError("Please enter a valid non-empty expression!")
+            if self.metrics is not None:
+                self.metrics.record_error(error)
+            raise error
+        
+        # stripped is now guaranteed to have some actual expression
+        return stripped
+
+    def compile(self, raw_input : str, dtype = None) -> CompiledExpression:
+        """ Parse and validate once, the returned expression can be evaluated repeatedly
+        dtype overrides the calculator's dtype for this expression
+        """
+        return self.compile_cached(self.strip_input(raw_input), dtype)
 
+    def calculate(self, raw_input : str, debug: bool = False, dtype = None):
+        stripped = self.strip_input(raw_input)
+        if debug:
+            return self.evaluate_cleaned(stripped, debug=debug, dtype=dtype)
+
+        return self.compile_cached(stripped, dtype).evaluate()
+
+    def evaluate(self, raw_input : str, /, **variables):
+        """ Evaluate with free variables bound to scalars or numpy arrays, eg evaluate("a*sin(b)+c", a=arr1, b=arr2, c=3.0)"""
+        return self.compile(raw_input).evaluate(**variables)
+
+    def compile_function(self, raw_input : str) -> Callable:
+        """ Generate a native python function for the expression, its parameters are the variables in order of appearance
+        eg "a*sin(b)+3" -> def f(a, b): return _clip(_f0(_f1(_f2(a), ...)))
+        """
+        stripped = self.strip_input(raw_input)
+        function = self.functionCache.get(stripped)
+        if self.metrics is not None:
+            self.metrics.record_cache("function", function is not None)
+        if function is None:
+            clip = self.clip_output
+            if self.dtype != FLOAT64:
+                # variables are taken as given, only the output is cast
+                clip = lambda output : cast_output(self.clip_output(output), self.dtype)
+            function = generate_function(self.compile_cached(stripped).program, clip)
+            self.functionCache.put(stripped, function)
+
+        return function
+
+    def evaluate_parallel(self, raw_input : str, variables : dict, workers : int = None, block_size : int = BLOCK_SIZE):
+        """ Evaluate over large arrays split into blocks of about block_size elements, run on a pool of workers threads"""
+        return self.compile(raw_input).evaluate_parallel(variables, workers, block_size)
+
+    def evaluate_file(self, raw_input : str, inputs : dict, out, chunk_rows : int = 65536) -> dict:
+        """ Evaluate over memory mapped .npy or raw (path, dtype) inputs in chunks of rows, writing a memory mapped .npy to out
+        eg evaluate_file("a*b+sqrt(c)", inputs={"a": "a.npy", "b": "b.npy", "c": "c.npy"}, out="out.npy")
+        returns rows, chunks, seconds and rows_per_second
+        """
+        return evaluate_file(self.compile(raw_input), inputs, out, chunk_rows)
+
+    def memo_stats(self) -> dict:
+        """ Hits, misses and sizes of the memoized operators' caches, by operator kind and symbol"""
+        stats = {}
+        for kind, operators in ((_nodes.BINARY, self.binaryoperators), (_nodes.UNARY, self.unaryoperators), (_nodes.SUFFIX, self.suffixoperators)):
+            for symbol, operator in operators.items():
+                if isinstance(operator["f"], MemoizedFunction):
+                    stats.setdefault(kind, {})[symbol] = operator["f"].stats()
+        return stats
+
+    def clear_memo(self, symbol : str = None):
+        """ Empty the caches of all memoized operators, or of the ones with this symbol"""
+        for operators in (self.binaryoperators, self.unaryoperators, self.suffixoperators):
+            for operatorSymbol, operator in operators.items():
+                if isinstance(operator["f"], MemoizedFunction) and symbol in (None, operatorSymbol):
+                    operator["f"].clear()
+
+    def formula_graph(self) -> FormulaGraph:
+        """ An empty graph of named formulas evaluated with this calculator"""
+        return FormulaGraph(self)
+
+    def iter_calculate_many(self, raw_inputs : Iterable[str], workers : int = None, executor : str = "process", chunksize : int = 256) -> Iterator:
+        """ Lazy version of calculate_many, reads raw_inputs as it goes and yields results in input order"""
+        return iter_calculate_many(self, raw_inputs, workers=workers, executor=executor, chunksize=chunksize)
+
+    def calculate_many(self, raw_inputs : Iterable[str], workers : int = None, executor : str = "process", chunksize : int = 256) -> list:
+        """ Calculate independent expressions on a pool of workers ("process" or "thread"), results are in input order
+        a failing expression gives its exception (eg the SyntaxError calculate raises) in place of its result
+        """
+        return list(self.iter_calculate_many(raw_inputs, workers=workers, executor=executor, chunksize=chunksize))
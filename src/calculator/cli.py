@@ -0,0 +1,114 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from itertools import tee
+from typing import Iterable, Iterator, TextIO
+
+from ._dtypes import resolve_dtype
+from ._utils import _to_plain, _to_json
+from .repl import build_basic_calc
+
+# calculators the command line can build, by name
+PRESETS = {
+    "basic": build_basic_calc,
+}
+
+
+def _read_lines(paths : list[str]) -> Iterator[str]:
+    # one expression per line, "-" or no paths reads stdin, blank lines are skipped
+    for path in paths or ["-"]:
+        stream = sys.stdin if path == "-" else open(path, encoding="utf-8")
+        try:
+            for line in stream:
+                line = line.strip()
+                if line:
+                    yield line
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+def _format_csv(records : Iterable[tuple]) -> Iterator[str]:
+    # None is written as an empty field
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(["expression", "result", "error"])
+    for record in records:
+        writer.writerow(record)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _format_jsonl(records : Iterable[tuple]) -> Iterator[str]:
+    # non-finite results are written as "Infinity", "-Infinity" or "NaN", so every line is strict json
+    for expression, result, error in records:
+        yield json.dumps({"expression": expression, "result": _to_json(result), "error": error}, allow_nan=False) + "\n"
+
+
+FORMATS = {
+    "csv": _format_csv,
+    "jsonl": _format_jsonl,
+}
+
+
+class _Failed(Exception):
+    pass
+
+
+def _records(expressions : Iterable[str], results : Iterable, on_error : str) -> Iterator[tuple]:
+    for expression, result in zip(expressions, results):
+        if not isinstance(result, Exception):
+            yield expression, _to_plain(result), None
+        elif on_error == "emit":
+            yield expression, None, f"{result.__class__.__name__}: {result}"
+        elif on_error == "fail":
+            raise _Failed(f"{expression}\n{result.__class__.__name__}: {result}")
+
+
+def _write_buffered(lines : Iterable[str], stream : TextIO, buffer_lines : int = 1024):
+    buffer = []
+    try:
+        for line in lines:
+            buffer.append(line)
+            if len(buffer) >= buffer_lines:
+                stream.write("".join(buffer))
+                buffer.clear()
+    finally:
+        # whatever was calculated before a failure is still written
+        stream.write("".join(buffer))
+        stream.flush()
+
+
+def main(argv : list[str] = None) -> int:
+    parser = argparse.ArgumentParser(prog="customcalc", description="Calculate one expression per line from files or stdin.")
+    parser.add_argument("files", nargs="*", help='input files, "-" or none reads stdin')
+    parser.add_argument("--preset", choices=PRESETS, default="basic", help="calculator to evaluate with")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="output format")
+    parser.add_argument("--on-error", choices=["skip", "emit", "fail"], default="emit",
+                        help="drop failing lines, write them with their error, or stop at the first one")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes, 1 calculates inline")
+    parser.add_argument("--chunksize", type=int, default=256, help="lines sent to a worker at a time")
+    parser.add_argument("--dtype", choices=["float32", "float64", "int64"], default=None, help="numeric dtype to evaluate in")
+    args = parser.parse_args(argv)
+
+    calculator = PRESETS[args.preset]()
+    if args.dtype is not None:
+        calculator.dtype = resolve_dtype(args.dtype)
+
+    # everything is a generator, only the lines in flight are held in memory
+    expressions, toCalculate = tee(_read_lines(args.files))
+    results = calculator.iter_calculate_many(toCalculate, workers=args.workers, chunksize=args.chunksize)
+    try:
+        _write_buffered(FORMATS[args.format](_records(expressions, results, args.on_error)), sys.stdout)
+    except _Failed as e:
+        print(f"Failed to calculate:\n{e}", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
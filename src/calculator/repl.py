@@ -1,3 +1,5 @@
+import math
+
 import numpy as np
 from .calculator import CalculatorBuilder, Calculator
 
@@ -14,6 +16,19 @@ def repl(c : Calculator):
             print("Exiting Program...")
 
 
+def _factorial(input_f):
+    # np.math (an alias of math) was removed in numpy 2
+    if isinstance(input_f, np.integer):
+        # keeps an int64 calculator in int64
+        return type(input_f)(math.factorial(input_f))
+    return float(math.factorial(int(input_f)) if input_f % 1 == 0 else math.factorial(input_f))
+
+
+def _factorial_guard(input_f):
+    # 171! is past the float range, refusing it up front spares computing eg 1e5! for minutes only to overflow
+    return input_f <= 170
+
+
 def build_basic_calc() -> Calculator:
     b = CalculatorBuilder()
     
@@ -22,8 +37,8 @@ def build_basic_calc() -> Calculator:
     b.addBinaryOperator("*", 1, np.multiply)
     b.addBinaryOperator("x", 1, np.multiply)
     b.addBinaryOperator("/", 1, np.divide)
-    b.addBinaryOperator("%", 1, lambda a, b : a % b)
-    b.addBinaryOperator("^", 2, np.power)
+    b.addBinaryOperator("%", 1, np.remainder)
+    b.addBinaryOperator("^", 2, np.power, rightAssociative=True)
 
     b.addUnaryOperator("sin", np.sin)
     b.addUnaryOperator("cos", np.cos)
@@ -41,7 +56,7 @@ def build_basic_calc() -> Calculator:
     b.addConstant("eps", 1/np.inf)
     b.addConstant("inf", np.inf)
 
-    b.addSuffixOperator("!", lambda input_f : float(np.math.factorial(int(input_f)) if input_f % 1 == 0 else np.math.factorial(input_f)))
+    b.addSuffixOperator("!", _factorial, guard=_factorial_guard)
 
     return b.build()
 
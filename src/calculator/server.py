@@ -0,0 +1,342 @@
+"""
+Asyncio calculation server speaking newline delimited JSON over a Unix socket or localhost TCP.
+
+request:  {"id": 1, "expression": "a*sin(b)", "variables": {"a": 2, "b": 0.5}}   (variables optional)
+response: {"id": 1, "result": 0.958..., "error": null}
+          {"id": 3, "result": ["Infinity", 1.0], "error": null}   (non-finite numbers as strings, so lines are strict json)
+          {"id": 2, "result": null, "error": "Missing Operand!...", "type": "SyntaxError"}
+
+Responses can arrive out of order, the id ties them to their request. Requests are micro-batched onto a
+thread or process pool holding a warm Calculator (and its parse cache). At most max_in_flight requests are
+accepted at once, past that the server stops reading from its connections so clients see backpressure.
+A request line longer than line_limit bytes is answered with an error (carrying its id if that comes first) and skipped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from . import _batch
+from ._limits import ResourceLimitError
+from ._utils import _to_plain, _to_json, _from_json
+from .repl import build_basic_calc
+
+
+def calculate_requests(calculator, requests : list[tuple[str, dict]]) -> list:
+    # errors are returned in place of the result, like calculate_many
+    results = []
+    for expression, variables in requests:
+        try:
+            results.append(calculator.evaluate(expression, **variables) if variables else calculator.calculate(expression))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _calculate_requests_in_worker(requests : list[tuple[str, dict]]) -> list:
+    return calculate_requests(_batch._worker_calculator, requests)
+
+
+# the start of a request, up to its id
+_REQUEST_ID = re.compile(rb'\s*\{\s*"id"\s*:\s*')
+
+
+def _oversized_id(head : bytes):
+    # the id of a request cut off by the line limit, when it is the first key (as CalculatorClient sends it)
+    match = _REQUEST_ID.match(head)
+    if match is None:
+        return None
+    try:
+        return json.JSONDecoder().raw_decode(head[match.end():].decode(errors="ignore"))[0]
+    except ValueError:
+        return None
+
+
+def _response(requestId, result) -> bytes:
+    if isinstance(result, Exception):
+        response = {"id": requestId, "result": None, "error": str(result), "type": result.__class__.__name__}
+        if isinstance(result, ResourceLimitError):
+            response["limit"] = result.limit
+    else:
+        response = {"id": requestId, "result": _to_json(_to_plain(result)), "error": None}
+    return json.dumps(response, allow_nan=False).encode() + b"\n"
+
+
+class CalculatorServer:
+    def __init__(
+        self,
+        calculator,
+        workers : int = None,
+        executor : str = "thread",
+        max_batch : int = 64,
+        batch_delay : float = 0.0005,
+        max_in_flight : int = 1024,
+        line_limit : int = 2**16,
+    ):
+        if executor not in ("process", "thread"):
+            raise ValueError('Executor must be "process" or "thread"!')
+        if max_batch < 1 or max_in_flight < 1 or line_limit < 1:
+            raise ValueError("Batch size, in flight limit and line limit must be at least 1!")
+
+        self.calculator = calculator
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.executor = executor
+        # a batch is sent as soon as max_batch requests are queued, or after waiting batch_delay seconds for more
+        self.max_batch = max_batch
+        self.batch_delay = batch_delay
+        self.max_in_flight = max_in_flight
+        # the stream buffer limit, in bytes, a longer request line is rejected
+        self.line_limit = line_limit
+
+        self.pool = None
+        self.server = None
+        self.queue = None
+        self.slots = None
+        self.batcher = None
+        self.connections = set()
+        # running _run_batch tasks, referenced so they aren't garbage collected mid batch
+        self.batches = set()
+
+    def _make_pool(self):
+        if self.executor == "process":
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_batch._init_worker, initargs=(self.calculator,))
+            self.func = _calculate_requests_in_worker
+        else:
+            self.pool = ThreadPoolExecutor(self.workers)
+            self.func = partial(calculate_requests, self.calculator)
+
+    async def _start(self, start_server):
+        self._make_pool()
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.max_in_flight)
+        self.batcher = asyncio.create_task(self._batch_loop())
+        self.server = await start_server(self._handle, limit=self.line_limit)
+        return self
+
+    async def start_tcp(self, host : str = "127.0.0.1", port : int = 0) -> "CalculatorServer":
+        """ Listen on localhost TCP, port 0 picks a free port (see address)"""
+        return await self._start(partial(asyncio.start_server, host=host, port=port))
+
+    async def start_unix(self, path : str) -> "CalculatorServer":
+        return await self._start(partial(asyncio.start_unix_server, path=path))
+
+    @property
+    def address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def serve_forever(self):
+        await self.server.serve_forever()
+
+    async def close(self):
+        self.server.close()
+        for connection in self.connections:
+            connection.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+        await self.server.wait_closed()
+        self.batcher.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _handle(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        pending = set()
+        connection = asyncio.current_task()
+        self.connections.add(connection)
+        try:
+            while True:
+                line, oversized = await self._read_line(reader)
+                if not line and not oversized:
+                    break
+                # waiting here stops reading the connection, which is the backpressure
+                await self.slots.acquire()
+                task = asyncio.create_task(self._respond(line, writer, oversized))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            await asyncio.gather(*pending)
+        except (ConnectionError, asyncio.CancelledError):
+            for task in pending:
+                task.cancel()
+        finally:
+            self.connections.discard(connection)
+            writer.close()
+
+    async def _read_line(self, reader : asyncio.StreamReader) -> tuple[bytes, bool]:
+        """ The next line (b"" at the end) and whether it went over the line limit, then only its start is kept"""
+        head = None
+        while True:
+            try:
+                line = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                line = e.partial
+            except asyncio.LimitOverrunError as e:
+                # readline would raise here and drop the connection, instead skip what is buffered and look for the end again
+                skipped = await reader.readexactly(e.consumed)
+                if head is None:
+                    head = skipped[:self.line_limit]
+                continue
+            return (head, True) if head is not None else (line, False)
+
+    async def _respond(self, line : bytes, writer : asyncio.StreamWriter, oversized : bool = False):
+        try:
+            if oversized:
+                requestId, result = _oversized_id(line), ValueError(f"Request line exceeds the limit of {self.line_limit} bytes!")
+            else:
+                requestId, result = await self._calculate(line)
+
+            writer.write(_response(requestId, result))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.slots.release()
+
+    async def _calculate(self, line : bytes) -> tuple:
+        requestId = None
+        try:
+            request = json.loads(line)
+            requestId = request.get("id")
+            expression = request["expression"]
+            variables = request.get("variables") or {}
+        except (ValueError, KeyError, AttributeError, TypeError):
+            return requestId, ValueError("Invalid request!")
+
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((expression, variables, future))
+        return requestId, await future
+
+    async def _batch_loop(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.queue.qsize() < self.max_batch - 1 and self.batch_delay > 0:
+                # give concurrent requests a moment to join the batch
+                await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            task = asyncio.create_task(self._run_batch(batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    async def _run_batch(self, batch : list[tuple]):
+        requests = [(expression, variables) for expression, variables, _ in batch]
+        pool = self.pool
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(pool, self.func, requests)
+        except BrokenProcessPool as e:
+            # a worker died (eg killed for memory), this batch fails but later ones get a fresh pool
+            results = [e] * len(batch)
+            if pool is self.pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._make_pool()
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+
+# exception types a client raises again, anything else becomes a RuntimeError
+_ERRORS = {error.__name__: error for error in (SyntaxError, ValueError, TypeError, ZeroDivisionError, OverflowError, ResourceLimitError)}
+
+
+class CalculatorClient:
+    """ Async client for CalculatorServer, many calculations can be awaited concurrently over one connection"""
+    def __init__(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.nextId = 0
+        self.pending : dict[int, asyncio.Future] = {}
+        self.receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect_tcp(cls, host : str = "127.0.0.1", port : int = 0, line_limit : int = 2**16) -> "CalculatorClient":
+        """ line_limit bounds a response line in bytes, raise it for large array results"""
+        return cls(*await asyncio.open_connection(host, port, limit=line_limit))
+
+    @classmethod
+    async def connect_unix(cls, path : str, line_limit : int = 2**16) -> "CalculatorClient":
+        return cls(*await asyncio.open_unix_connection(path, limit=line_limit))
+
+    async def _receive(self):
+        try:
+            while line := await self.reader.readline():
+                response = json.loads(line)
+                future = self.pending.pop(response["id"], None)
+                if future is None or future.done():
+                    continue
+                if response["error"] is None:
+                    future.set_result(_from_json(response["result"]))
+                else:
+                    error = _ERRORS.get(response.get("type"), RuntimeError)
+                    future.set_exception(error(response["error"], response.get("limit")) if error is ResourceLimitError else error(response["error"]))
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection to the calculator server closed!"))
+
+    async def calculate(self, expression : str, **variables):
+        requestId = self.nextId
+        self.nextId += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[requestId] = future
+
+        request = {"id": requestId, "expression": expression}
+        if variables:
+            request["variables"] = variables
+        self.writer.write(json.dumps(request).encode() + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        await self.receiver
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+async def _serve(args):
+    server = CalculatorServer(build_basic_calc(), workers=args.workers, executor=args.executor,
+                              max_batch=args.max_batch, max_in_flight=args.max_in_flight, line_limit=args.line_limit)
+    if args.unix is not None:
+        await server.start_unix(args.unix)
+    else:
+        await server.start_tcp(args.host, args.port)
+    print(f"Serving on {server.address}")
+    await server.serve_forever()
+
+
+def main(argv : list[str] = None):
+    parser = argparse.ArgumentParser(prog="python -m calculator.server", description="Serve build_basic_calc over newline delimited JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", default=None, help="unix socket path, instead of TCP")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-in-flight", type=int, default=1024)
+    parser.add_argument("--line-limit", type=int, default=2**16, help="longest request line in bytes")
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        print("Exiting Program...")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 import numpy as np
-from calculator import build_basic_calc
+from calculator import build_basic_calc, CalculatorBuilder, ResourceLimitError
 
 def test_calculator():
     calc = build_basic_calc()
@@ -30,3 +30,754 @@ def test_calculator():
     assert calc.calculate("cos(1+1)") == np.cos(2), "cos(1+1) failed"
     assert calc.calculate("cos(sin(cos(sin(tan(2)))))") == np.cos(np.sin(np.cos(np.sin(np.tan(2))))), "cos(sin(cos(sin(tan(2))))) failed"
 
+
+
+def test_compile():
+    calc = build_basic_calc()
+
+    compiled = calc.compile("cos(1+1) * 2 - 3")
+    expected = np.cos(2) * 2 - 3
+    # repeated evaluation reuses the same tree
+    assert compiled.evaluate() == expected, "first evaluation failed"
+    assert compiled.evaluate() == expected, "second evaluation failed"
+    assert calc.calculate("cos(1+1) * 2 - 3") == expected, "calculate after compile failed"
+
+    try:
+        compiled.source = "1+1"
+        assert False, "CompiledExpression should be immutable"
+    except AttributeError:
+        pass
+
+    # parse cache is bounded and reused
+    assert calc.compile("1+2") is calc.compile("1 + 2"), "parse cache miss"
+    for i in range(calc.parseCacheSize + 10):
+        calc.calculate(f"{i}+1")
+    assert len(calc.parseCache) == calc.parseCacheSize, "parse cache is not bounded"
+
+
+def test_variables():
+    calc = build_basic_calc()
+
+    a = np.linspace(-2, 2, 101)
+    b = np.linspace(0, 3, 101)
+    result = calc.evaluate("a*sin(b)+c", a=a, b=b, c=3.0)
+    assert np.allclose(result, a * np.sin(b) + 3.0), "vectorized evaluation failed"
+
+    # broadcasting between arrays and scalars
+    compiled = calc.compile("2*a-1")
+    assert compiled.evaluate(a=3) == 5, "scalar binding failed"
+    assert np.array_equal(compiled.evaluate(a=np.arange(3)), [-1, 1, 3]), "array binding failed"
+
+    # clip_output works element-wise
+    clipped = calc.evaluate("sin(t)", t=np.array([0, np.pi, np.pi / 2]))
+    assert np.array_equal(clipped, [0, 0, 1]), "element-wise clipping failed"
+
+    try:
+        calc.calculate("2*a")
+        assert False, "unbound variable should fail"
+    except SyntaxError:
+        pass
+
+
+def test_nested_unary_single_tree():
+    calc = build_basic_calc()
+
+    compiled = calc.compile("cos(sin(t+1))")
+    # nested arguments are parsed into child nodes up front
+    assert compiled.tree.argument.operator == "sin", "nested argument not parsed"
+    assert compiled.evaluate(t=2) == np.cos(np.sin(3)), "nested evaluation failed"
+
+    depth = 200
+    expected = 0.5
+    for _ in range(depth):
+        expected = np.sin(expected)
+    assert calc.calculate("sin(" * depth + "0.5" + ")" * depth) == expected, "deep nesting failed"
+
+
+def test_lexer():
+    import time
+
+    calc = build_basic_calc()
+
+    tokens = calc.tokenize_input_string("2*sin(-1)+a!")
+    assert [(t.kind, t.text) for t in tokens] == [
+        ("number", "2"), ("operator", "*"), ("operator", "sin"), ("separator", "("),
+        ("number", "-1"), ("separator", ")"), ("operator", "+"), ("identifier", "a"), ("suffix", "!"),
+    ], "wrong tokens"
+    assert (tokens[4].start, tokens[4].end) == (6, 8), "wrong token span"
+
+    # negation right after a value is a subtraction, even across separators
+    assert [t.text for t in calc.tokenize_input_string("3(-5)")] == ["3", "(", "-", "5", ")"]
+    assert [t.text for t in calc.tokenize_input_string("3*(-5)")] == ["3", "*", "(", "-5", ")"]
+
+    # names are read whole, an operator only if the whole name is one
+    assert calc.evaluate("cost*2+sinh_a", cost=3, sinh_a=1) == 7, "name split at an operator prefix"
+    assert [(t.kind, t.text) for t in calc.tokenize_input_string("-cos(t)*-cost")] == [
+        ("negation", "-"), ("operator", "cos"), ("separator", "("), ("identifier", "t"), ("separator", ")"),
+        ("operator", "*"), ("identifier", "-cost"),
+    ], "wrong name tokens"
+    assert calc.calculate("2 x 3") == calc.calculate("2x3") == 6, "x not read as an operator"
+    assert calc.calculate("(1+2)x3") == 9 and calc.calculate("sin(0)x2") == 0, "operator after a separator read as a name"
+    assert calc.calculate("pi x2") == calc.calculate("pi*2"), "operator after a name read as a name"
+    assert calc.calculate("3!x2") == 12, "operator after a suffix read as a name"
+
+    # spaces between names separate them
+    b = CalculatorBuilder()
+    b.addBinaryOperator("plus", 0, np.add)
+    b.addConstant("one", 1)
+    assert b.build().calculate("one plus one  plus (one)") == 3, "word operator not separated by spaces"
+
+    # large inputs tokenize in one pass
+    big = "1.5*a+" * 20000 + "1"
+    assert len(calc.tokenize_input_string(big)) == 4 * 20000 + 1, "large input failed"
+    start = time.perf_counter()
+    calc.tokenize_input_string("1" + "e" * 200000)
+    assert time.perf_counter() - start < 1, "letters in a long number lexed in quadratic time"
+
+
+def test_parser():
+    calc = build_basic_calc()
+
+    # precedence and associativity
+    assert calc.calculate("1+2*3^2+1") == 20, "precedence failed"
+    assert calc.calculate("2^3^2") == 512, "right associativity failed"
+    assert calc.calculate("8/4/2") == 1, "left associativity failed"
+    assert calc.calculate("(1-2)-(3-4)") == 0, "separators failed"
+    assert calc.calculate("-(1+2)*3") == -9, "negation failed"
+    assert calc.evaluate("-a^2", a=3) == 9, "negated variable failed"
+    assert calc.calculate("-(-1)") == 1 and calc.calculate("2*-(-3)") == 6 and calc.calculate("-(2)*-(-1)") == -2, "negation inside a negation failed"
+
+    b = CalculatorBuilder()
+    b.addBinaryOperator("-", 0, np.subtract, rightAssociative=True)
+    assert b.build().calculate("5-3-1") == 3, "custom right associativity failed"
+
+    for bad in ["3(4)", "2sin(1)", "2*(+1)", "3()"]:
+        try:
+            calc.calculate(bad)
+            assert False, f"{bad} should fail"
+        except SyntaxError:
+            pass
+
+    # long chains don't hit the recursion limit
+    n = 50000
+    assert calc.calculate("+".join(["1"] * n)) == n, "long chain failed"
+
+
+def test_bytecode():
+    calc = build_basic_calc()
+
+    compiled = calc.compile("2*sin(a)-a^2+3!")
+    program = compiled.program
+    assert compiled.variables == ("a",), "wrong variables"
+    # a is loaded twice but stored once
+    assert program.disassemble().count("LOAD_VAR") == 2, "wrong disassembly"
+    assert len(program) == 10, "wrong program length"
+
+    for expr in ["1+2*3^2+1", "-(1+2)*3", "cos(sin(cos(sin(tan(2)))))", "2^3^2-8/4/2"]:
+        compiled = calc.compile(expr)
+        assert compiled.program.run() == calc.collapse(compiled.tree).getValue(), f"{expr} differs from collapse"
+
+
+def test_codegen():
+    calc = build_basic_calc()
+
+    expressions = ["1+1", "2^3^2", "8%3", "7/2-1x3", "-(1+2)*3", "cos(pi)", "tan(pi)", "asin(sin(0))",
+                   "acos(cos(0))", "atan(1)", "sqrt(16)+abs(-2)", "log(e)+ln(1)", "1+1*3(-5)"]
+    for expr in expressions:
+        f = calc.compile_function(expr)
+        assert f() == calc.calculate(expr), f"{expr} differs from calculate"
+
+    f = calc.compile_function("a*sin(b)+3")
+    assert f is calc.compile_function("a * sin(b) + 3"), "function cache miss"
+    a = np.linspace(0, 1, 11)
+    assert np.array_equal(f(a, 2.0), calc.evaluate("a*sin(b)+3", a=a, b=2.0)), "array inputs differ"
+
+    # long chains are split into locals instead of nesting too deep
+    assert calc.compile_function("+".join(["1"] * 5000))() == 5000, "long chain failed"
+
+
+def test_optimizer():
+    calc = build_basic_calc()
+
+    # constant subtrees fold into a single constant
+    compiled = calc.compile("a*(2*pi/360)+sqrt(2)+3!")
+    assert compiled.program.disassemble().count("LOAD_CONST") == 3, "constants not folded"
+    assert compiled.evaluate(a=1) == 2 * np.pi / 360 + np.sqrt(2) + 6, "folded result differs"
+
+    # identical subtrees are computed once
+    compiled = calc.compile("sin(t)^2+cos(t)*sin(t)")
+    assert compiled.program.disassemble().count("(sin)") == 1, "subexpression not shared"
+    assert compiled.evaluate(t=0.5) == np.sin(0.5) ** 2 + np.cos(0.5) * np.sin(0.5), "shared result differs"
+    assert calc.compile_function("sin(t)^2+cos(t)*sin(t)")(0.5) == compiled.evaluate(t=0.5), "codegen differs"
+
+    # impure operators are never folded or shared
+    calls = []
+    def impure(x):
+        calls.append(x)
+        return x + len(calls)
+
+    b = CalculatorBuilder()
+    b.addBinaryOperator("+", 0, np.add)
+    b.addUnaryOperator("rand", impure, pure=False)
+    compiled = b.build().compile("rand(1)+rand(1)")
+    assert len(calls) == 0, "impure operator was folded"
+    assert compiled.evaluate() == 5, "impure operator was shared"
+
+
+def test_scalar_mode():
+    from calculator import SCALAR_RTOL
+
+    calc = build_basic_calc()
+    b = CalculatorBuilder()
+    b.addBinaryOperator("+", 0, np.add)
+    b.addBinaryOperator("/", 1, np.divide)
+    b.addBinaryOperator("^", 2, np.power, rightAssociative=True)
+    b.addUnaryOperator("sin", np.sin)
+    b.addUnaryOperator("log", np.log)
+    b.addUnaryOperator("sqrt", np.sqrt)
+    b.addUnaryOperator("twice", lambda x: np.multiply(x, 2), scalarFunc=lambda x: x * 2)
+    b.setScalarMode(True)
+    scalar_calc = b.build()
+
+    # edge cases follow numpy instead of raising
+    cases = [("p/q", 1.0, 0.0), ("p/q", -1.0, 0.0), ("p/q", 0.0, 0.0), ("p^q", -8.0, 1/3), ("p^q", 0.0, -1.0),
+             ("p^q", 10.0, 400.0), ("p^q", -10.0, 401.0), ("log(p)+q", 0.0, 1.0), ("log(p)+q", -1.0, 1.0),
+             ("sqrt(p)+q", -1.0, 1.0), ("sin(p/q)", 1.0, 0.0), ("twice(p)+sin(q)/3", 3.0, 2.0)]
+    for expr, p, q in cases:
+        compiled = scalar_calc.compile(expr)
+        with np.errstate(all="ignore"):
+            numpy_result = compiled.program.run({"p": p, "q": q})
+        scalar_result = compiled.evaluate(p=p, q=q)
+        assert type(scalar_result) in (float, int), f"{expr} did not take the scalar path"
+        assert np.isclose(scalar_result, numpy_result, rtol=SCALAR_RTOL, atol=0, equal_nan=True), f"{expr} differs from numpy"
+
+    expr = "a*sin(b)+3-a^2*cos(b)/2+sqrt(abs(a))"
+    compiled = calc.compile(expr)
+    assert "scalarInstructions" not in vars(compiled.program), "scalar instructions built without scalar mode"
+    calc.scalarMode = True
+    for a in np.linspace(-5, 5, 21):
+        assert np.isclose(compiled.evaluate(a=float(a), b=0.7), calc.compile_function(expr)(a, 0.7), rtol=SCALAR_RTOL), "scalar mode differs"
+
+    # arrays still take the numpy path
+    assert np.array_equal(compiled.evaluate(a=np.ones(3), b=0.7), calc.compile_function(expr)(np.ones(3), 0.7)), "array path differs"
+    assert np.array_equal(compiled.evaluate(a=[1.0, 1.0, 1.0], b=(0.7,)), compiled.evaluate(a=np.ones(3), b=np.array([0.7]))), "list took the scalar path"
+
+
+def test_calculate_many():
+    import pickle
+
+    calc = build_basic_calc()
+    restored = pickle.loads(pickle.dumps(calc))
+    assert restored.calculate("2^3^2 + 3! + 7%4") == calc.calculate("2^3^2 + 3! + 7%4"), "pickled calculator differs"
+
+    expressions = [f"{i}*2+sin(0)" for i in range(300)] + ["1+", "sin(1", "2*a"]
+    for executor in ["thread", "process"]:
+        results = calc.calculate_many(expressions, workers=2, executor=executor, chunksize=64)
+        assert results[:300] == [i * 2 for i in range(300)], f"{executor} results out of order"
+        for expr, error in zip(expressions[300:], results[300:]):
+            assert isinstance(error, SyntaxError), f"{executor} did not report the error for {expr}"
+            try:
+                calc.calculate(expr)
+            except SyntaxError as e:
+                assert str(e) == str(error), f"{executor} error message differs"
+
+
+def test_thread_safety():
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    calc = build_basic_calc()
+    t = np.linspace(0, 1, 1000)
+    expressions = [f"sin(t*{i})^2 + cos(t*{i})^2 - {i}%7 + ({i}+1)!" for i in range(40)]
+    expected = [calc.evaluate(expr, t=t) for expr in expressions]
+
+    try:
+        compiled = calc.compile(expressions[0])
+        compiled.tree.name = "changed"
+        assert False, "parsed tree is mutable"
+    except AttributeError:
+        pass
+
+    # a fresh calculator so the threads race on parsing and the caches as well as on evaluation
+    calc = build_basic_calc()
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            for _ in range(5):
+                results = list(pool.map(lambda expr: calc.evaluate(expr, t=t), expressions * 4))
+                for expr, result, value in zip(expressions * 4, results, expected * 4):
+                    assert np.array_equal(result, value), f"{expr} not deterministic under threads"
+    finally:
+        sys.setswitchinterval(interval)
+
+
+def test_evaluate_file(tmp_path):
+    calc = build_basic_calc()
+    rng = np.random.default_rng(0)
+    a, b, c = rng.random(10_001), rng.random(10_001), rng.random(10_001)
+    for name, value in {"a": a, "b": b, "c": c}.items():
+        np.save(tmp_path / f"{name}.npy", value)
+
+    out = tmp_path / "out.npy"
+    stats = calc.evaluate_file("a*b+sqrt(c)+q", inputs={"a": tmp_path / "a.npy", "b": str(tmp_path / "b.npy"), "c": tmp_path / "c.npy", "q": 2.0}, out=out, chunk_rows=1000)
+    assert stats["rows"] == 10_001 and stats["chunks"] == 11, "wrong chunking"
+    assert stats["rows_per_second"] > 0, "no throughput reported"
+    assert np.array_equal(np.load(out), calc.evaluate("a*b+sqrt(c)+q", a=a, b=b, c=c, q=2.0)), "chunked result differs"
+
+    # raw binary columns
+    b.astype(np.float32).tofile(tmp_path / "b.f32")
+    calc.evaluate_file("a*b", inputs={"a": tmp_path / "a.npy", "b": (tmp_path / "b.f32", np.float32)}, out=out, chunk_rows=4096)
+    assert np.array_equal(np.load(out), a * b.astype(np.float32)), "raw column result differs"
+
+    np.save(tmp_path / "empty.npy", np.zeros(0))
+    stats = calc.evaluate_file("a*2+1", inputs={"a": tmp_path / "empty.npy"}, out=out)
+    assert stats["rows"] == 0 and stats["chunks"] == 0 and np.load(out).shape == (0,), "empty input not handled"
+
+
+def test_evaluate_parallel():
+    calc = build_basic_calc()
+    rng = np.random.default_rng(1)
+    a, b = rng.random(100_003), rng.random(100_003) - 0.5
+    expr = "sin(a*b)^2 + sin(a*b)*b - sqrt(a)/(b+3) + 2^-40*a"
+
+    expected = calc.evaluate(expr, a=a, b=b)
+    for workers in [1, 4]:
+        result = calc.evaluate_parallel(expr, {"a": a, "b": b}, workers=workers, block_size=4096)
+        assert np.array_equal(result, expected), f"blocked result differs with {workers} workers"
+
+    # rows are split, a broadcast row vector is not
+    grid = rng.random((5000, 3))
+    row = rng.random(3)
+    result = calc.evaluate_parallel("a*b+abs(a-b)", {"a": grid, "b": row}, workers=3, block_size=999)
+    assert np.array_equal(result, calc.evaluate("a*b+abs(a-b)", a=grid, b=row)), "broadcast blocked result differs"
+
+    # int64 stays int64 and wraps around like evaluate, / still promotes
+    ints = np.arange(-50_000, 50_003, dtype=np.int64)
+    ints[7] = 2**62
+    for expr in ["a*3+1", "a*2-a%7", "a/4+1"]:
+        compiled = calc.compile(expr, dtype="int64")
+        expected = compiled.evaluate(a=ints)
+        result = compiled.evaluate_parallel({"a": ints}, workers=4, block_size=4096)
+        assert result.dtype == expected.dtype and np.array_equal(result, expected), f"int64 blocked result differs for {expr}"
+
+    # arrays of another dtype than the calculator's get the same results as evaluate, not float64 buffers
+    for values in [np.full(10_000, 3_000_000_000, dtype=np.int64), rng.random(10_000).astype(np.float32)]:
+        expected = calc.evaluate("a*a*a", a=values)
+        result = calc.evaluate_parallel("a*a*a", {"a": values}, workers=4, block_size=4096)
+        assert result.dtype == expected.dtype and np.array_equal(result, expected), f"{values.dtype} blocked result differs"
+
+
+def test_dtype():
+    calc = build_basic_calc()
+    result = calc.calculate("pi*2 + 0.1", dtype="float32")
+    assert result.dtype == np.float32 and result == np.float32(np.pi) * 2 + np.float32(0.1), "float32 not kept"
+
+    assert calc.calculate("2^10 + 3! - 7%3", dtype="int64") == 1029, "wrong int64 result"
+    assert calc.calculate("9007199254740993", dtype="int64") == 9007199254740993, "int64 literal rounded through float"
+    assert calc.calculate("-9007199254740993+0", dtype="int64") == -9007199254740993, "negative int64 literal rounded through float"
+    assert calc.calculate("2^10 + 3! - 7%3", dtype="int64").dtype == np.int64, "int64 not kept"
+    assert calc.calculate("7/2", dtype="int64") == 3.5, "/ should promote to float64"
+    assert calc.calculate("sqrt(16)", dtype="int64").dtype == np.float64, "sqrt should promote to float64"
+
+    b = CalculatorBuilder()
+    b.addBinaryOperator("+", 0, np.add)
+    b.addBinaryOperator("*", 1, np.multiply)
+    b.setDtype("float32")
+    arrays = b.build().evaluate("a*a+1", a=np.arange(4))
+    assert arrays.dtype == np.float32 and list(arrays) == [1, 2, 5, 10], "builder dtype not applied to variables"
+
+    try:
+        b.setDtype("complex128")
+        assert False, "unsupported dtype accepted"
+    except ValueError:
+        pass
+
+
+def test_cli(tmp_path, capsys):
+    import json
+    from calculator.cli import main
+
+    path = tmp_path / "expressions.txt"
+    path.write_text("1+2\n\nsin(0)*3\n1+\n2^0.5\n1e400\n")
+
+    def strict(constant):
+        raise ValueError(f"{constant} is not strict json")
+
+    assert main([str(path), "--format", "jsonl"]) == 0, "emit should not fail"
+    records = [json.loads(line, parse_constant=strict) for line in capsys.readouterr().out.splitlines()]
+    assert [r["result"] for r in records] == [3.0, 0, None, 2 ** 0.5, "Infinity"], "wrong jsonl results"
+    assert records[2]["error"].startswith("SyntaxError"), "error not emitted"
+
+    assert main([str(path), "--on-error", "skip", "--workers", "2"]) == 0, "skip should not fail"
+    assert capsys.readouterr().out.splitlines() == ["expression,result,error", "1+2,3.0,", "sin(0)*3,0,", "2^0.5,1.4142135623730951,", "1e400,inf,"], "wrong csv output"
+
+    assert main([str(path), "--on-error", "fail"]) == 1, "fail should return an error status"
+    captured = capsys.readouterr()
+    assert captured.out.splitlines()[-1] == "sin(0)*3,0,", "lines before the failure not written"
+    assert "Invalid Binary Operator!" in captured.err, "failure not reported"
+
+
+def _crash_worker(x):
+    import os
+    os._exit(1)
+
+
+def test_server(tmp_path):
+    import asyncio
+    from calculator.server import CalculatorServer, CalculatorClient
+
+    calc = build_basic_calc()
+    expressions = [f"{i}*2+sin(0)" for i in range(200)]
+
+    async def run():
+        async with await CalculatorServer(calc, workers=2, max_batch=16, max_in_flight=8).start_tcp() as server:
+            async with await CalculatorClient.connect_tcp(*server.address[:2]) as client:
+                results = await asyncio.gather(*(client.calculate(expr) for expr in expressions))
+                assert results == [calc.calculate(expr) for expr in expressions], "wrong results over tcp"
+                assert await client.calculate("a*b+1", a=2, b=3) == 7, "variables not sent"
+                assert await client.calculate("a*1e400", a=[1, -1]) == [np.inf, -np.inf], "non-finite results not sent"
+                try:
+                    await client.calculate("1+")
+                    assert False, "error not raised"
+                except SyntaxError as e:
+                    assert "Invalid Binary Operator!" in str(e), "wrong error message"
+
+                try:
+                    await client.calculate("200!")
+                    assert False, "guard not applied"
+                except ResourceLimitError as e:
+                    assert e.limit == "guard", "limit not sent"
+
+        # an oversized line gets an error, the connection stays open
+        async with await CalculatorServer(calc, workers=1, line_limit=1024).start_tcp() as server:
+            async with await CalculatorClient.connect_tcp(*server.address[:2]) as client:
+                for length in [2000, 100_000]:
+                    try:
+                        await client.calculate("1+" * length + "1")
+                        assert False, "oversized line not rejected"
+                    except ValueError as e:
+                        assert "limit of 1024 bytes" in str(e), "wrong error message"
+                assert await client.calculate("1+1") == 2, "connection dropped after an oversized line"
+
+        # a dead worker fails its batch, later requests get a fresh pool
+        b = CalculatorBuilder()
+        b.addBinaryOperator("+", 0, np.add)
+        b.addUnaryOperator("crash", _crash_worker)
+        async with await CalculatorServer(b.build(), workers=1, executor="process").start_tcp() as server:
+            async with await CalculatorClient.connect_tcp(*server.address[:2]) as client:
+                try:
+                    await client.calculate("crash(1)")
+                    assert False, "broken pool not reported"
+                except RuntimeError:
+                    pass
+                assert await client.calculate("1+1") == 2, "pool not recreated"
+
+        async with await CalculatorServer(calc, workers=1).start_unix(str(tmp_path / "calc.sock")):
+            async with await CalculatorClient.connect_unix(str(tmp_path / "calc.sock")) as client:
+                assert await client.calculate("2^10") == 1024, "wrong result over a unix socket"
+
+    asyncio.run(run())
+
+
+def test_benchmark_corpus():
+    import importlib.util
+    import pathlib
+    import warnings
+
+    path = pathlib.Path(__file__).parent.parent / "benchmarks" / "corpus.py"
+    spec = importlib.util.spec_from_file_location("corpus", path)
+    corpus = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(corpus)
+
+    expressions = corpus.generate_corpus(20, terms=30, depth=5, mix="all", unary=4, seed=3)
+    assert expressions == corpus.generate_corpus(20, terms=30, depth=5, mix="all", unary=4, seed=3), "corpus not deterministic"
+
+    calc = build_basic_calc()
+    with warnings.catch_warnings(), np.errstate(all="ignore"):
+        warnings.simplefilter("ignore")
+        for expr in expressions:
+            assert expr.count("(") - sum(expr.count(f"{u}(") for u in corpus.UNARY) == 5, f"{expr} not nested 5 deep"
+            calc.calculate(expr)
+
+
+def test_metrics():
+    calc = build_basic_calc()
+    assert calc.metrics is None, "metrics should be off by default"
+
+    with calc.profile() as metrics:
+        for _ in range(3):
+            calc.evaluate("sin(a)+a*2", a=1.0)
+        for expr in ["1+", "sin(1", "", "2*b"]:
+            try:
+                calc.calculate(expr)
+            except (SyntaxError, ValueError):
+                pass
+
+    snapshot = metrics.snapshot()
+    assert calc.metrics is None, "profile should restore the previous metrics"
+    assert snapshot["caches"]["parse"] == {"hits": 2, "misses": 4}, "wrong parse cache counts"
+    assert snapshot["operators"]["unary"]["sin"] == 3 and snapshot["operators"]["binary"]["*"] == 3, "wrong operator counts"
+    assert snapshot["stages"]["evaluate"]["calls"] == 4 and snapshot["stages"]["tokenize"]["calls"] == 4, "wrong stage counts"
+    assert snapshot["errors"] == {"Invalid Binary Operator": 1, "Invalid Separator Level": 1, "ValueError": 1, "No value given for variable": 1}, "wrong error categories"
+
+    events = []
+    calc.add_hook(lambda event, value: events.append(event))
+    calc.calculate("1+2*3")
+    assert events == ["tokens", "processed", "tree", "program"], "hooks not called"
+
+
+def test_flat_tree():
+    import pickle
+
+    calc = build_basic_calc()
+    compiled = calc.compile("sin(a*b)^2 + sin(a*b)*b - sqrt(2)/(b+3) + 3!")
+    assert not hasattr(compiled.tree, "__dict__"), "nodes should use slots"
+    assert calc.collapse(pickle.loads(pickle.dumps(compiled.tree)), {"a": 1.5, "b": 2.0}).getValue() == compiled.evaluate(a=1.5, b=2.0), "pickled tree differs"
+
+    flat = calc.flatten(compiled.tree, compiled.source)
+    assert flat.opcodes.dtype == np.int8 and flat.constants.dtype == np.float64, "buffers not typed"
+    # a*b and sin(a*b) are shared, so stored once
+    assert len(flat) == 15, "shared subtrees not stored once"
+    for a, b in [(1.5, 2.0), (np.linspace(0, 1, 5), 0.5)]:
+        expected = calc.collapse(compiled.tree, {"a": a, "b": b}).getValue()
+        assert np.array_equal(flat.evaluate({"a": a, "b": b}), expected), "flat tree evaluates differently"
+        assert np.array_equal(calc.collapse(flat.to_tree(), {"a": a, "b": b}).getValue(), expected), "rebuilt tree differs"
+
+
+def test_serialization(tmp_path):
+    calc = build_basic_calc()
+    compiled = calc.compile("sin(a*b)^2 + sin(a*b)*-b - sqrt(2)/(b+3) + 3! + a%2")
+    compiled.save(tmp_path / "program.bin")
+
+    loaded = build_basic_calc().load(tmp_path / "program.bin")
+    assert isinstance(loaded.program.code, memoryview), "code should be mapped, not copied"
+    assert loaded.program.disassemble() == compiled.program.disassemble(), "program changed by a round trip"
+    assert loaded.evaluate(a=1.5, b=2.0) == compiled.evaluate(a=1.5, b=2.0), "loaded program evaluates differently"
+    assert calc.collapse(loaded.tree, {"a": 1.5, "b": 2.0}).getValue() == compiled.evaluate(a=1.5, b=2.0), "rebuilt tree differs"
+
+    calc.save_library(tmp_path / "library.bin", {"f": compiled, "g": "2*a+1", "h": "sqrt(b)"})
+    library = build_basic_calc().load_library(tmp_path / "library.bin")
+    assert list(library) == ["f", "g", "h"] and "g" in library and len(library.loaded) == 0, "library loaded eagerly"
+    assert library["g"].evaluate(a=3) == 7 and library["h"].evaluate(b=16) == 4, "library program evaluates differently"
+    assert library["f"].program.disassemble() == compiled.program.disassemble(), "library program changed by a round trip"
+
+    integral = calc.compile("2*a+7%3", dtype="int64")
+    assert calc.load_bytes(integral.to_bytes()).evaluate(a=3).dtype == np.int64, "dtype not kept"
+
+    b = CalculatorBuilder()
+    b.addBinaryOperator("+", 0, np.add)
+    b.addBinaryOperator("*", 0, np.multiply)
+    for data, message in [(compiled.to_bytes(), "differently configured"), (b"nonsense", "Not a serialized")]:
+        try:
+            b.build().load_bytes(data)
+            assert False, "invalid program loaded"
+        except ValueError as e:
+            assert message in str(e), "wrong error"
+    try:
+        b.build().load_library(tmp_path / "library.bin")
+        assert False, "library of a different calculator loaded"
+    except ValueError as e:
+        assert "differently configured" in str(e), "wrong error"
+
+
+def test_formula_graph():
+    calc = build_basic_calc()
+    graph = calc.formula_graph()
+    graph.define("area", "w*h")
+    graph.define("volume", "area*d")
+    graph.define("mass", "volume*rho")
+    graph.define("label", "w+1")
+    graph.set_inputs(w=2.0, h=3.0, d=4.0, rho=0.5)
+
+    assert graph["mass"] == 12, "wrong value"
+    assert graph.recompute() == [], "nothing should be recomputed"
+
+    graph.set_inputs(d=5.0)
+    assert graph.recompute() == ["volume", "mass"], "only formulas downstream of d should be recomputed"
+    assert graph["mass"] == 15, "wrong value after an input change"
+
+    # area does not change, so volume and mass are not recomputed
+    graph.set_inputs(w=3.0, h=2.0)
+    assert graph.recompute() == ["area", "label"], "unchanged values should stop propagation"
+
+    graph.define("area", "w*h*2")
+    assert graph["mass"] == 30 and graph.recompute() == [], "redefinition not propagated"
+
+    try:
+        graph.define("w2", "mass+1")
+        graph.define("area", "w2*h")
+        assert False, "cycle not detected"
+    except ValueError as e:
+        assert "area -> w2 -> mass -> volume -> area" in str(e), "wrong cycle"
+    assert graph["area"] == 12, "rejected definition should leave the graph unchanged"
+
+    # dependents defined before their dependencies, leveled once at the next recompute
+    graph = calc.formula_graph()
+    for i in reversed(range(500)):
+        graph.define(f"f{i}", f"f{i-1}+1" if i else "q+1")
+    graph.set_inputs(q=0.0)
+    assert graph["f499"] == 500 and graph.levels["f499"] == 499, "wrong value or level for a reverse defined chain"
+    try:
+        graph.define("f0", "f499*2")
+        assert False, "cycle through the chain not detected"
+    except ValueError as e:
+        assert str(e).startswith("Formula cycle: f0 -> f499 -> f498 -> ") and str(e).endswith("f1 -> f0 !"), "wrong cycle"
+
+
+def test_gradient():
+    calc = build_basic_calc()
+    expressions = ["a*sin(b)+a^2/b - sqrt(a)", "atan(a*b)*log(b) + a%b + b^a", "-a*tan(b)/abs(a-3) + acos(b/2)"]
+    a, b = np.array([0.5, 1.5, 2.5]), np.array([0.3, 1.1, 1.75])
+    h = 1e-6
+    for expr in expressions:
+        value, partials = calc.gradient(expr, ["a", "b"], a=a, b=b)
+        assert np.allclose(value, calc.evaluate(expr, a=a, b=b)), f"{expr} value differs"
+        numeric_a = (calc.evaluate(expr, a=a+h, b=b) - calc.evaluate(expr, a=a-h, b=b)) / (2*h)
+        numeric_b = (calc.evaluate(expr, a=a, b=b+h) - calc.evaluate(expr, a=a, b=b-h)) / (2*h)
+        assert np.allclose(partials["a"], numeric_a, rtol=1e-5) and np.allclose(partials["b"], numeric_b, rtol=1e-5), f"{expr} partials differ"
+
+        scalar_value, scalar_partials = calc.gradient(expr, ["a", "b"], a=1.5, b=1.1)
+        assert np.isclose(scalar_partials["a"], partials["a"][1]) and np.isclose(scalar_value, value[1]), f"{expr} scalar gradient differs"
+
+    b = CalculatorBuilder()
+    b.addBinaryOperator("+", 0, np.add)
+    b.addUnaryOperator("cube", lambda x: x**3, derivative=lambda x: 3*x**2)
+    b.addUnaryOperator("noderivative", lambda x: x)
+    custom = b.build()
+    assert custom.gradient("cube(p)+p", "p", p=2.0) == (10.0, {"p": 13.0}), "custom derivative rule not used"
+    try:
+        custom.gradient("noderivative(p)", "p", p=2.0)
+        assert False, "missing derivative rule not reported"
+    except ValueError as e:
+        assert "noderivative" in str(e), "wrong error"
+
+
+def test_memoize():
+    import pickle
+
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        return value * 2
+
+    for policy in ["lru", "lfu"]:
+        calls.clear()
+        b = CalculatorBuilder()
+        b.addBinaryOperator("+", 0, np.add)
+        b.addBinaryOperator("^", 1, np.power, memoize=policy, memoizeSize=2)
+        b.addUnaryOperator("slow", slow, memoize=policy, memoizeSize=2)
+        calc = b.build()
+
+        for value in [1.0, 1.0, 2.0, 1.0, 3.0, 1.0]:
+            assert calc.evaluate("slow(p)", p=value) == value * 2, "wrong memoized result"
+        # lru evicts 2.0 then keeps 1.0 and 3.0, lfu keeps the frequent 1.0 as well
+        assert calls == [1.0, 2.0, 3.0], f"{policy} called the function too often"
+        assert calc.memo_stats()["unary"]["slow"]["hits"] == 3, f"{policy} hits not counted"
+
+        assert calc.evaluate("slow(p)", p=np.array([1.0, 2.0])).tolist() == [2.0, 4.0], "arrays should bypass the cache"
+        assert calc.memo_stats()["unary"]["slow"]["skipped"] == 1, "array call not counted as skipped"
+        assert calc.evaluate("slow(p)", p=-0.0) == 0 and calls[-1] == -0.0, "-0.0 should not hit the 0.0 entry"
+
+        calc.clear_memo("slow")
+        assert calc.memo_stats()["unary"]["slow"]["size"] == 0, "cache not cleared"
+        assert calc.evaluate("2^p+1", p=3.0) == 9 and calc.gradient("2^p", "p", p=3.0)[1]["p"] == 8 * np.log(2), "memoized ufunc lost its rules"
+        assert pickle.loads(pickle.dumps(calc.binaryoperators["^"]["f"]))(2.0, 3.0) == 8, "memoized operator not picklable"
+
+
+def test_validate():
+    calc = build_basic_calc()
+    assert calc.validate("a*sin(b)+3!") == [], "valid expression flagged"
+
+    diagnostics = calc.validate("1++2*sin 3)+")
+    assert [d.code for d in diagnostics] == ["multiple_binary_operators", "invalid_operator_separators", "invalid_separators", "invalid_binary_operator", "missing_operand"], "wrong diagnostics"
+    assert diagnostics[0].span == (2, 3) and diagnostics[0].offset == 2, "wrong position"
+
+    for expr in ["1+", "sin(1", "()", "sin()", "1)", "!3", "1+(2*)", "( )"]:
+        first = calc.validate(expr)[0]
+        try:
+            calc.calculate(expr)
+            assert False, f"{expr} should not calculate"
+        except (SyntaxError, ValueError) as e:
+            assert first.message == str(e), f"{expr} diagnostic differs from the raised error"
+
+    # offsets and spans are in the input as given, the message matches calculate's
+    raw = "1 +  + 2"
+    first = calc.validate(raw)[0]
+    assert first.span == (5, 6) and raw[first.start:first.end] == "+" and first.offset == 5, "span not in the raw input"
+    assert first.expression == "1++2" and first.expressionOffset == 2, "wrong stripped position"
+    try:
+        calc.calculate(raw)
+    except SyntaxError as e:
+        assert first.message == str(e), "diagnostic differs from the raised error"
+
+    results = calc.validate_many(["1+1", "1+", ""])
+    assert [len(r) for r in results] == [0, 2, 1] and results[2][0].code == "empty_expression", "wrong validate_many results"
+
+
+def test_limits():
+    import pickle
+    import time
+
+    def limit_of(func, *args, **kwargs):
+        try:
+            func(*args, **kwargs)
+        except ResourceLimitError as e:
+            return e.limit
+        return None
+
+    calc = build_basic_calc()
+    start = time.perf_counter()
+    assert limit_of(calc.calculate, "1e5!") == "guard", "huge factorial not refused"
+    assert time.perf_counter() - start < 0.5, "guard was not checked up front"
+    assert calc.calculate("5!") == 120, "guard refused a small factorial"
+    results = calc.calculate_many(["1+1", "200!", "2+2"], workers=2, executor="process", chunksize=1)
+    assert results[0] == 2 and results[2] == 4, "guarded input broke the batch"
+    assert isinstance(results[1], ResourceLimitError) and results[1].limit == "guard", "limit error not returned from a worker process"
+    calc.scalarMode = True
+    assert limit_of(calc.evaluate, "a!", a=500.0) == "guard", "guard skipped in scalar mode"
+
+    def slow_sin(x):
+        time.sleep(0.02)
+        return np.sin(x)
+
+    b = CalculatorBuilder()
+    b.addBinaryOperator("+", 0, np.add)
+    b.addBinaryOperator("*", 1, np.multiply)
+    b.addUnaryOperator("sin", np.sin)
+    b.addUnaryOperator("slow", slow_sin)
+    b.addUnaryOperator("sqrt", np.sqrt, guard=lambda x : x >= 0)
+    b.setLimits(maxInputLength=60, maxTokens=30, maxDepth=3, maxNodes=12, maxSteps=100, timeBudget=0.03)
+    calc = b.build()
+
+    assert calc.calculate("sin(sin(1))+2*3") == np.sin(np.sin(1))+6, "limits rejected a small expression"
+    assert limit_of(calc.calculate, "1" + "+1" * 40) == "maxInputLength", "input length not limited"
+    assert limit_of(calc.calculate, "1+1+1+1+1+1+1+1+1+1+1+1+1+1+1+1") == "maxTokens", "token count not limited"
+    assert limit_of(calc.calculate, "sin(sin(sin(sin(1))))") == "maxDepth", "nesting depth not limited"
+    assert limit_of(calc.calculate, "1*2+3*4+5*6+7") == "maxNodes", "node count not limited"
+    assert limit_of(calc.evaluate, "a*2+a", a=np.ones(50)) == "maxSteps", "step budget not applied to arrays"
+    assert limit_of(calc.evaluate, "slow(slow(slow(a)))", a=1.0) == "timeBudget", "time budget not applied"
+    assert limit_of(calc.calculate, "slow(slow(slow(1)))") == "timeBudget", "time budget not applied to constant folding"
+    assert limit_of(calc.evaluate, "a*q", a=np.ones((10, 1)), q=np.ones((1, 10))) == "maxSteps", "step budget ignored broadcasting"
+    assert limit_of(calc.evaluate, "sqrt(a)", a=np.array([4.0, -1.0])) == "guard", "guard not applied to arrays"
+    assert list(calc.evaluate("sqrt(a)", a=np.array([4.0, 9.0]))) == [2, 3], "guard refused valid arrays"
+
+    # a guard survives memoization, memoized guarded ufuncs keep their scalar equivalent and derivative
+    b = CalculatorBuilder()
+    b.addBinaryOperator("+", 0, np.add)
+    b.addUnaryOperator("sqrt", np.sqrt, guard=lambda x : x >= 0, memoize="lru")
+    guarded_calc = b.build()
+    assert limit_of(guarded_calc.evaluate, "sqrt(a)", a=-1.0) == "guard", "guard lost when memoized"
+    assert guarded_calc.gradient("sqrt(a)", "a", a=4.0)[1]["a"] == 0.25, "memoized guarded ufunc lost its derivative"
+    guarded_calc.scalarMode = True
+    assert limit_of(guarded_calc.evaluate, "sqrt(a)", a=-1.0) == "guard", "guard lost in scalar mode"
+
+    metrics = calc.enable_metrics()
+    limit_of(calc.calculate, "sin(sin(sin(sin(1))))")
+    assert metrics.snapshot()["errors"] == {"maxDepth": 1}, "limit errors not counted"
+
+    b = CalculatorBuilder()
+    b.addBinaryOperator("+", 0, np.add)
+    b.setLimits(maxTokens=5)
+    assert limit_of(pickle.loads(pickle.dumps(b.build())).calculate, "1+1+1+1") == "maxTokens", "limits lost when pickled"